@@ -0,0 +1,91 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+from config import cache_size_mb
+
+class LRUCache:
+    # Keeps the most recently used values until their total size goes over max_bytes
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = object_size(value)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            # Values bigger than the whole cache are not kept
+            if size > self.max_bytes:
+                return value
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            # Evict the least recently used entries until the cache fits again
+            while self.total_bytes > self.max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.total_bytes -= old_size
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self.total_bytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+@st.cache_resource
+def get_cache(name):
+    # One cache per name, shared by every session of the server
+    return LRUCache(cache_size_mb[name] * 1024 ** 2)
+
+def object_size(value):
+    # Approximate memory footprint in bytes of a cached value
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sum(object_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(object_size(k) + object_size(v) for k, v in value.items())
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 0
+
+def make_fingerprint(*parts):
+    # Stable hash of plain python values (strings, numbers, lists, dicts...)
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def content_fingerprint(data):
+    # Hash of raw bytes, e.g. the content of an uploaded file
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
@@ -0,0 +1,110 @@
+import pandas as pd
+import numpy as np
+import plotly.graph_objects as go
+from config import chart_max_points, chart_max_outliers
+
+# The charts of the exploratory analysis are built from aggregates computed here (bin counts, quartiles,
+# densities), so the figures sent to the browser stay small whatever the number of rows. Sampled points
+# are sent as float32, which is plenty for a chart
+
+def finite_values(data):
+    # Values as a float array without the missing ones, whatever the backend (NumPy or Arrow)
+    values = np.asarray(data.to_numpy(dtype='float64', na_value=np.nan))
+    return values[np.isfinite(values)]
+
+def sample_positions(n, max_points, random_state=0):
+    # The same rows are sampled every time for the same data
+    if n <= max_points:
+        return np.arange(n)
+    return np.sort(np.random.default_rng(random_state).choice(n, max_points, replace=False))
+
+def bin_counts(values, nbins=20):
+    return np.histogram(values, bins=nbins)
+
+def histogram_figure(counts, edges, name):
+    return go.Figure(go.Bar(
+        x=(edges[:-1] + edges[1:]) / 2,
+        y=counts,
+        width=np.diff(edges),
+        name=str(name),
+        hovertemplate='%{customdata[0]:.4g} - %{customdata[1]:.4g}<br>Frequency: %{y}<extra></extra>',
+        customdata=np.column_stack([edges[:-1], edges[1:]])
+    ))
+
+def box_statistics(values):
+    # Quartiles and whiskers like a box plot drawn from the raw data (whiskers at the furthest values
+    # within 1.5 IQR of the box), and a sample of the values beyond them
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    outliers = values[(values < inside.min()) | (values > inside.max())]
+    return {'q1': q1, 'median': median, 'q3': q3, 'lowerfence': inside.min(), 'upperfence': inside.max(),
+            'mean': values.mean(), 'outliers': outliers[sample_positions(len(outliers), chart_max_outliers)]}
+
+def grouped_box_statistics(data, groups):
+    # Box statistics of the values of each group, the groups are sorted
+    values = np.asarray(data.to_numpy(dtype='float64', na_value=np.nan))
+    codes, levels = pd.factorize(groups, sort=True)
+    keep = np.isfinite(values) & (codes >= 0)
+    values, codes = values[keep], codes[keep]
+
+    order = np.argsort(codes, kind='stable')
+    splits = np.split(values[order], np.cumsum(np.bincount(codes, minlength=len(levels)))[:-1])
+    return {str(level): box_statistics(v) for level, v in zip(levels, splits) if len(v)}
+
+def box_figure(stats, name):
+    # One box per entry of stats (name of the box: its statistics), drawn from the statistics only
+    fig = go.Figure(go.Box(
+        x=list(stats),
+        q1=[s['q1'] for s in stats.values()],
+        median=[s['median'] for s in stats.values()],
+        q3=[s['q3'] for s in stats.values()],
+        lowerfence=[s['lowerfence'] for s in stats.values()],
+        upperfence=[s['upperfence'] for s in stats.values()],
+        mean=[s['mean'] for s in stats.values()],
+        name=str(name)
+    ))
+    outlier_x = np.concatenate([np.full(len(s['outliers']), box, dtype=object) for box, s in stats.items()] + [np.empty(0, dtype=object)])
+    outlier_y = np.concatenate([s['outliers'] for s in stats.values()] + [np.empty(0)])
+    if len(outlier_y):
+        fig.add_trace(go.Scattergl(x=outlier_x, y=outlier_y.astype('float32'), mode='markers', name='Outliers', marker=dict(size=4)))
+    return fig
+
+def linear_trend(x, y):
+    # Least squares line in closed form: slope = cov(x, y) / var(x)
+    x_mean, y_mean = x.mean(), y.mean()
+    dx = x - x_mean
+    denominator = (dx * dx).sum()
+    slope = (dx * (y - y_mean)).sum() / denominator if denominator else 0.0
+    return slope, y_mean - slope * x_mean
+
+def scatter_figure(data_x, data_y, nbins=60):
+    # Small data is drawn point by point (with WebGL). Larger data is drawn as a density of the rows
+    # per cell, with a sample of the points on top
+    x = np.asarray(data_x.to_numpy(dtype='float64', na_value=np.nan))
+    y = np.asarray(data_y.to_numpy(dtype='float64', na_value=np.nan))
+    keep = np.isfinite(x) & np.isfinite(y)
+    x, y = x[keep], y[keep]
+
+    fig = go.Figure()
+    rows = sample_positions(len(x), chart_max_points)
+    if len(rows) < len(x):
+        counts, x_edges, y_edges = np.histogram2d(x, y, bins=nbins)
+        fig.add_trace(go.Heatmap(
+            x=(x_edges[:-1] + x_edges[1:]) / 2,
+            y=(y_edges[:-1] + y_edges[1:]) / 2,
+            z=np.where(counts.T > 0, counts.T, np.nan),
+            colorscale='Blues',
+            colorbar=dict(title='Rows'),
+            name='Density',
+            hovertemplate='%{x:.4g}, %{y:.4g}<br>Rows: %{z}<extra></extra>'
+        ))
+    fig.add_trace(go.Scattergl(
+        x=x[rows].astype('float32'), y=y[rows].astype('float32'), mode='markers', marker=dict(size=4, opacity=0.5 if len(rows) < len(x) else 1),
+        name='Sample of the observations' if len(rows) < len(x) else 'Observations'
+    ))
+    if len(x) > 1:
+        slope, intercept = linear_trend(x, y)
+        x_range = np.array([x.min(), x.max()])
+        fig.add_trace(go.Scatter(x=x_range, y=intercept + slope * x_range, mode='lines', name=f'OLS trendline (slope {slope:.4g})'))
+    return fig
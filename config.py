@@ -1,2 +1,44 @@
+import os
 
 page_titles = ['Login', 'Introduction', 'Exploratory data analysis', 'Data preparation', 'Model training', 'Results analysis', 'Results interpretation', 'Summary']
+
+# Size limits (in MB) of the caches shared by every session on the server
+cache_size_mb = {
+    'ingestion': 2048,
+    'schema': 16,
+    'profiles': 64,
+    'exploration': 256,
+    'preparation': 2048,
+    'training': 2048,
+}
+
+# Number of rows used to decide whether a text column actually holds numbers
+schema_sample_rows = 10000
+
+# Text columns with fewer distinct values than this share of rows are stored as categories
+category_max_ratio = 0.5
+
+# Background jobs (training, model inspection) run on this many threads, pages check them every job_poll_seconds
+job_workers = 4
+job_poll_seconds = 0.5
+
+# Cores a single step (training, permutation importance...) may use, sessions can lower it on the sidebar
+max_n_jobs = int(os.environ.get('APP_MAX_N_JOBS', os.cpu_count() or 1))
+
+# Charts of the exploratory analysis: scatter plots with more rows than chart_max_points show a density with
+# a sample of that many points on top, box plots show a sample of at most chart_max_outliers outliers
+chart_max_points = 2000
+chart_max_outliers = 500
+
+# Column profiles of the exploratory analysis: the most frequent values kept per categorical column, and
+# whether every column is profiled in the background as soon as a dataset is loaded
+profile_top_values = 50
+profile_in_background = True
+
+# Correlation analysis: rows sampled from larger datasets when sampling is on, and levels kept per
+# categorical column for Cramér's V (the others are counted together as 'Other')
+correlation_max_rows = 200000
+correlation_max_levels = 50
+
+# Levels of each variable shown in the table of two categorical variables, the others are counted as 'Other'
+contingency_max_levels = 20
@@ -0,0 +1,173 @@
+import pandas as pd
+import numpy as np
+from scipy.cluster.hierarchy import linkage, leaves_list
+from scipy.spatial.distance import squareform
+from config import correlation_max_rows, correlation_max_levels, contingency_max_levels
+from cache_utils import get_cache, make_fingerprint
+from charts import sample_positions
+from profiling import is_numeric
+
+def standardized(values):
+    # Columns centred and scaled to a norm of 1 (float32), so that their correlations are one matrix product
+    values = values - values.mean(axis=0)
+    norm = np.sqrt(np.einsum('ij,ij->j', values, values))
+    # Constant columns have no correlation, like in pandas
+    norm[norm == 0] = np.nan
+    return values / norm
+
+def pairwise_correlation(values):
+    # Correlations over the rows where both columns are present, like pandas: counts, sums and sums of
+    # squares of each column restricted to the rows of the other one are matrix products with the mask
+    present = ~np.isnan(values)
+    mask = present.astype(values.dtype)
+    # Centring first keeps the differences of sums accurate in float32
+    values = np.where(present, values - np.nanmean(values, axis=0), 0).astype(values.dtype)
+    n = mask.T @ mask
+    sums = values.T @ mask
+    squares = (values * values).T @ mask
+    with np.errstate(all='ignore'):
+        covariance = values.T @ values - sums * sums.T / n
+        variance = squares - sums ** 2 / n
+        matrix = covariance / np.sqrt(variance * variance.T)
+    # Pairs with less than two rows in common, or constant on them, have no correlation
+    matrix[(n < 2) | (variance <= 0) | (variance.T <= 0)] = np.nan
+    return matrix
+
+def correlation_matrix(values):
+    if np.isnan(values).any():
+        matrix = pairwise_correlation(values)
+    else:
+        z = standardized(values)
+        matrix = z.T @ z
+    np.fill_diagonal(matrix, np.where(np.isnan(np.diag(matrix)), np.nan, 1))
+    return np.clip(matrix, -1, 1)
+
+def factorized(data, top_k=None):
+    # Integer codes of the levels of a column (-1 when missing), the most frequent level first. With top_k,
+    # the less frequent levels share one last code, 'Other'
+    codes, levels = pd.factorize(data)
+    counts = np.bincount(codes[codes >= 0], minlength=len(levels))
+    order = np.argsort(-counts, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    codes = np.where(codes >= 0, rank[np.maximum(codes, 0)], -1)
+    levels = [str(level) for level in np.asarray(levels)[order]]
+    if top_k is not None and len(levels) > top_k:
+        codes = np.where(codes >= top_k, top_k, codes)
+        levels = levels[:top_k] + ['Other']
+    return codes, levels
+
+def contingency(codes_1, codes_2, n_1, n_2):
+    # Counts of every pair of levels in one pass, rows with a missing level are left out
+    keep = (codes_1 >= 0) & (codes_2 >= 0)
+    return np.bincount(codes_1[keep] * n_2 + codes_2[keep], minlength=n_1 * n_2).reshape(n_1, n_2)
+
+def cached_codes(df, fingerprint, column, top_k):
+    # Codes of a column are kept, so a new pair only counts its rows
+    key = make_fingerprint(fingerprint, 'codes', column, top_k)
+    cache = get_cache('exploration')
+    codes = cache.get(key)
+    if codes is None:
+        codes = cache.put(key, factorized(df[column], top_k))
+    return codes
+
+def cached_contingency(df, fingerprint, var_1, var_2, top_k=contingency_max_levels):
+    # Table of counts of two categorical variables (like pd.crosstab), levels beyond the top_k most frequent
+    # counted as 'Other'. It is kept per pair, in both directions
+    key = make_fingerprint(fingerprint, 'contingency', sorted([var_1, var_2], key=str), top_k)
+    cache = get_cache('exploration')
+    table = cache.get(key)
+    if table is None:
+        first, second = sorted([var_1, var_2], key=str)
+        codes_1, levels_1 = cached_codes(df, fingerprint, first, top_k)
+        codes_2, levels_2 = cached_codes(df, fingerprint, second, top_k)
+        table = cache.put(key, pd.DataFrame(
+            contingency(codes_1, codes_2, len(levels_1), len(levels_2)),
+            index=pd.Index(levels_1, name=first),
+            columns=pd.Index(levels_2, name=second)
+        ))
+    return table if str(var_1) <= str(var_2) else table.T
+
+def cramers_v(table):
+    table = table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+    n = table.sum()
+    if min(table.shape) < 2:
+        return np.nan
+    expected = np.outer(table.sum(axis=1), table.sum(axis=0)) / n
+    chi2 = ((table - expected) ** 2 / expected).sum()
+    return np.sqrt(chi2 / (n * (min(table.shape) - 1)))
+
+def cramers_v_matrix(df):
+    codes = [factorized(df[c], correlation_max_levels) for c in df.columns]
+    matrix = np.eye(len(codes), dtype='float32')
+    for i in range(len(codes)):
+        for j in range(i + 1, len(codes)):
+            table = contingency(codes[i][0], codes[j][0], len(codes[i][1]), len(codes[j][1]))
+            matrix[i, j] = matrix[j, i] = cramers_v(table)
+    return matrix
+
+def is_ordered(data):
+    return isinstance(data.dtype, pd.CategoricalDtype) and data.cat.ordered
+
+def correlation_columns(df, method):
+    if method == "Cramér's V":
+        return [c for c in df.columns if not is_numeric(df[c])]
+    # Ordered categories have ranks, the levels of other categorical columns have no order
+    if method == 'Spearman':
+        return [c for c in df.columns if is_numeric(df[c]) or is_ordered(df[c])]
+    return [c for c in df.columns if is_numeric(df[c])]
+
+def cached_correlation(df, fingerprint, method, sample):
+    # Correlations between every pair of (numeric, or categorical for Cramér's V) columns, computed once per
+    # dataset and options. Spearman is Pearson on the ranks, missing values leave out their rows pair by pair
+    key = make_fingerprint(fingerprint, 'correlation', method, sample)
+    cache = get_cache('exploration')
+    matrix = cache.get(key)
+    if matrix is not None:
+        return matrix
+
+    columns = correlation_columns(df, method)
+    if sample and len(df) > correlation_max_rows:
+        df = df.iloc[sample_positions(len(df), correlation_max_rows)]
+    if method == "Cramér's V":
+        values = cramers_v_matrix(df[columns])
+    else:
+        data = df[columns]
+        if method == 'Spearman':
+            # Ordered categories are ranked by their codes (-1 when missing)
+            data = data.apply(lambda c: c.cat.codes.where(c.cat.codes >= 0).astype('float32') if is_ordered(c) else c)
+        if method == 'Spearman' and data.isna().any().any():
+            # Ranks depend on the rows both columns have, so each pair is ranked again (slower, by pandas)
+            values = data.astype('float64').corr(method='spearman').to_numpy()
+        else:
+            if method == 'Spearman':
+                data = data.rank()
+            values = correlation_matrix(data.to_numpy(dtype='float32', na_value=np.nan))
+    return cache.put(key, pd.DataFrame(values, index=columns, columns=columns))
+
+def strongest_pairs(matrix, k):
+    # The k pairs of different columns with the largest absolute correlation
+    values = matrix.to_numpy()
+    i, j = np.triu_indices(len(values), 1)
+    r = values[i, j]
+    valid = np.flatnonzero(~np.isnan(r))
+    top = valid[np.argsort(-np.abs(r[valid]), kind='stable')[:k]]
+    return pd.DataFrame({
+        'Variable 1': matrix.index[i[top]],
+        'Variable 2': matrix.columns[j[top]],
+        'Correlation': r[top]
+    })
+
+def heatmap_matrix(matrix, max_columns):
+    # Wide tables keep the columns most correlated with another one. The columns are ordered by
+    # hierarchical clustering, so groups of correlated columns sit together
+    strength = np.abs(matrix.to_numpy())
+    np.fill_diagonal(strength, np.nan)
+    with np.errstate(all='ignore'):
+        strength = np.nan_to_num(strength, nan=0)
+    keep = np.sort(np.argsort(-strength.max(axis=1, initial=0), kind='stable')[:max_columns])
+    if len(keep) > 2:
+        distance = 1 - strength[np.ix_(keep, keep)]
+        np.fill_diagonal(distance, 0)
+        keep = keep[leaves_list(linkage(squareform(distance, checks=False), method='average'))]
+    return matrix.iloc[keep, keep]
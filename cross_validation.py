@@ -0,0 +1,115 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import scipy.sparse as sp
+import joblib
+import os
+import shutil
+import tempfile
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import KFold, StratifiedKFold
+from cache_utils import get_cache, make_fingerprint
+from jobs import submit_job, job_result, session_n_jobs
+from preprocessing import model_input
+from metrics import regression_metrics, classification_metrics
+
+def cross_validation_fingerprint():
+    # Folds depend on the trained model (data, variables, parameters) and on how the rows are split
+    return make_fingerprint(
+        st.session_state.model_fingerprint,
+        st.session_state.evaluation_mode,
+        st.session_state.cv_folds
+    )
+
+def fold_metrics(problem_type, y, y_pred):
+    # The metrics of the results page, so precision, recall and F1 are of the positive class for two classes
+    if problem_type == 'Regression':
+        metrics = regression_metrics(y, {'residuals': y.astype('float64') - y_pred})
+        return {k: metrics[k] for k in ['MAE', 'MSE', 'RMSE', 'R²']}
+    metrics = classification_metrics(y, {'pred': y_pred})
+    return {k: metrics[k] for k in ['Accuracy', 'Precision', 'Recall', 'F1 Score']}
+
+def fit_fold(ml_mod, x, y, train_rows, test_rows):
+    # Runs in a worker process: x is the memory-mapped matrix shared by every fold
+    ml_mod = clone(ml_mod)
+    ml_mod.fit(x[train_rows], y[train_rows])
+    return test_rows, ml_mod.predict(x[test_rows])
+
+def cross_validation_job(job, fingerprint, ml_mod, x, y, problem_type, n_folds, stratified, random_state, n_jobs):
+    # Observations without a target can't be used, whatever the model
+    keep = y.notna().to_numpy()
+    columns = list(x.columns)
+    x = model_input(x[keep], ml_mod)
+    if not sp.issparse(x):
+        x = x.to_numpy(dtype='float64', na_value=np.nan)
+    y = y[keep].to_numpy()
+
+    # The folds get their cores from the process pool, and the matrix is given as an array, so
+    # native categorical columns are passed by position
+    ml_mod = clone(ml_mod)
+    if 'n_jobs' in ml_mod.get_params():
+        ml_mod.set_params(n_jobs=1)
+    if isinstance(ml_mod.get_params().get('categorical_features'), list):
+        ml_mod.set_params(categorical_features=[columns.index(c) for c in ml_mod.categorical_features])
+
+    splitter = StratifiedKFold if stratified else KFold
+    folds = list(splitter(n_splits=n_folds, shuffle=True, random_state=random_state).split(x, y))
+
+    # The matrix is written once to disk and memory-mapped read-only by every worker, instead of
+    # being pickled to each of them
+    folder = tempfile.mkdtemp(prefix='cv_')
+    try:
+        # (joblib memory-maps the large arrays of a sparse matrix for the workers itself)
+        if not sp.issparse(x):
+            path = os.path.join(folder, 'x.joblib')
+            joblib.dump(x, path)
+            x = joblib.load(path, mmap_mode='r')
+
+        oof_pred = np.empty(len(y), dtype=y.dtype if problem_type == 'Classification' else 'float64')
+        metrics = []
+        job.report(0, n_folds, 'folds evaluated')
+        with job.timed('Cross-validation', n_jobs):
+            results = Parallel(n_jobs=n_jobs, return_as='generator')(
+                delayed(fit_fold)(ml_mod, x, y, train_rows, test_rows) for train_rows, test_rows in folds
+            )
+            for i, (test_rows, y_pred) in enumerate(results):
+                oof_pred[test_rows] = y_pred
+                metrics.append(fold_metrics(problem_type, y[test_rows], y_pred))
+                job.report(i + 1, n_folds, 'folds evaluated')
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    fold_table = pd.DataFrame(metrics, index=[f'Fold {i + 1}' for i in range(n_folds)])
+    fold_table.loc['Mean'] = fold_table.iloc[:n_folds].mean()
+    fold_table.loc['Std'] = fold_table.iloc[:n_folds].std()
+
+    return get_cache('training').put(fingerprint, {
+        'folds': fold_table,
+        'oof_metrics': fold_metrics(problem_type, y, oof_pred),
+        'y': pd.Series(y),
+        'oof_pred': pd.DataFrame(oof_pred, columns=['pred']),
+        'timings': job.timings
+    })
+
+def cached_cross_validation(fingerprint):
+    # Metrics of the folds are reused while the model and the folds don't change, otherwise they
+    # are computed in the background (None until they are ready)
+    result = get_cache('training').get(fingerprint)
+    if result is None:
+        submit_job(
+            'cross_validation',
+            fingerprint,
+            cross_validation_job,
+            fingerprint,
+            st.session_state.ml_mod,
+            st.session_state.df_treated[st.session_state.input_variables],
+            st.session_state.df_treated[st.session_state.to_predict],
+            st.session_state.problem_type,
+            st.session_state.cv_folds,
+            st.session_state.evaluation_mode == 'Stratified k-fold',
+            st.session_state.parameter_random_state,
+            session_n_jobs()
+        )
+        result = job_result('cross_validation', 'Cross-validating the model')
+    return result
@@ -0,0 +1,130 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from cache_utils import get_cache, make_fingerprint, content_fingerprint
+from config import schema_sample_rows, category_max_ratio
+
+def uploaded_file_fingerprint(uploaded_file):
+    # Hashing a big file on every rerun is slow, so the hash is computed once per upload
+    if 'upload_hashes' not in st.session_state:
+        st.session_state.upload_hashes = {}
+    if uploaded_file.file_id not in st.session_state.upload_hashes:
+        st.session_state.upload_hashes[uploaded_file.file_id] = content_fingerprint(uploaded_file.getvalue())
+    return st.session_state.upload_hashes[uploaded_file.file_id]
+
+def text_to_numeric(values):
+    # pd.to_numeric doesn't turn invalid Arrow strings into nulls, so they are converted as objects
+    if isinstance(values.dtype, pd.ArrowDtype):
+        return pd.to_numeric(values.astype(object), errors='coerce').convert_dtypes(dtype_backend='pyarrow')
+    return pd.to_numeric(values, errors='coerce')
+
+def infer_numeric_columns(df, sample_rows=schema_sample_rows):
+    # A text column is numeric if at least 90% of its distinct values are numbers.
+    # All text columns are checked at once on a bounded sample of rows
+    text_columns = [c for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])]
+    if not text_columns:
+        return []
+    sample = df[text_columns]
+    if len(sample) > sample_rows:
+        sample = sample.sample(n=sample_rows, random_state=0)
+
+    values = sample.melt(var_name='column', value_name='value').dropna().drop_duplicates()
+    values['numeric'] = text_to_numeric(values['value']).notna()
+    counts = values.groupby('column')['numeric'].agg(['sum', 'size']).reindex(text_columns, fill_value=0)
+    return list(counts.index[counts['sum'] >= 0.9 * counts['size']])
+
+def file_format(uploaded_file):
+    return uploaded_file.name.rsplit('.', 1)[-1].lower()
+
+def file_columns(uploaded_file, sep):
+    # Column names found in the file, read from its header/schema only
+    fingerprint = make_fingerprint(uploaded_file_fingerprint(uploaded_file), sep, 'columns')
+    cache = get_cache('schema')
+    columns = cache.get(fingerprint)
+    if columns is None:
+        uploaded_file.seek(0)
+        if file_format(uploaded_file) == 'parquet':
+            columns = pq.read_schema(uploaded_file).names
+        elif file_format(uploaded_file) == 'feather':
+            columns = pa.ipc.open_file(uploaded_file).schema.names
+        else:
+            columns = list(pd.read_csv(uploaded_file, sep=sep, index_col=False, nrows=0).columns)
+        cache.put(fingerprint, columns)
+    return columns
+
+def read_file(uploaded_file, sep, decimal, engine='pandas', columns=None):
+    # Parquet and Feather files are read with Arrow-backed dtypes, as is a CSV parsed by the
+    # multithreaded pyarrow engine. Only the requested columns are loaded
+    uploaded_file.seek(0)
+    if file_format(uploaded_file) == 'parquet':
+        return pd.read_parquet(uploaded_file, columns=columns, dtype_backend='pyarrow')
+    if file_format(uploaded_file) == 'feather':
+        return pd.read_feather(uploaded_file, columns=columns, dtype_backend='pyarrow')
+    if engine == 'pyarrow':
+        return pd.read_csv(uploaded_file, sep=sep, decimal=decimal, usecols=columns, engine='pyarrow', dtype_backend='pyarrow')
+    return pd.read_csv(uploaded_file, sep=sep, index_col=False, decimal=decimal, usecols=columns)
+
+def downcast_float(values, mode):
+    # float32 is used when it keeps every value, or always in aggressive mode
+    if isinstance(values.dtype, pd.ArrowDtype):
+        smaller = values.astype(pd.ArrowDtype(pa.float32()))
+    else:
+        smaller = values.astype('float32')
+    if mode == 'Aggressive (float32)':
+        return smaller
+    same_values = np.array_equal(
+        smaller.to_numpy(dtype='float64', na_value=np.nan),
+        values.to_numpy(dtype='float64', na_value=np.nan),
+        equal_nan=True
+    )
+    return smaller if same_values else values
+
+def optimize_memory(df, mode):
+    # Store each column in the smallest type that keeps its values and return the memory report
+    before = df.memory_usage(index=False, deep=True)
+    types_before = df.dtypes.astype(str)
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_bool_dtype(values):
+            continue
+        if pd.api.types.is_integer_dtype(values):
+            df[col] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values):
+            df[col] = downcast_float(values, mode)
+        elif not isinstance(values.dtype, pd.CategoricalDtype) and values.nunique() <= category_max_ratio * len(values):
+            df[col] = values.astype('category')
+
+    report = pd.DataFrame({
+        'Type before': types_before,
+        'Type after': df.dtypes.astype(str),
+        'Before (MB)': before / 1024 ** 2,
+        'After (MB)': df.memory_usage(index=False, deep=True) / 1024 ** 2
+    })
+    return df, report
+
+def load_file(uploaded_file, sep, decimal, engine='pandas', columns=None, infer_types=False, memory_mode='Off'):
+    # The loaded file (with its numeric text columns converted and its memory optimized if asked)
+    # is cached by its content and loading options, so reruns don't parse it again
+    fingerprint = make_fingerprint(uploaded_file_fingerprint(uploaded_file), sep, decimal, engine, columns, infer_types, memory_mode)
+    cache = get_cache('ingestion')
+    entry = cache.get(fingerprint)
+    if entry is None:
+        df = read_file(uploaded_file, sep, decimal, engine, columns)
+
+        # Parquet and Feather files already store their column types
+        if infer_types and file_format(uploaded_file) == 'csv':
+            schema_cache = get_cache('schema')
+            numeric_columns = schema_cache.get(fingerprint)
+            if numeric_columns is None:
+                numeric_columns = schema_cache.put(fingerprint, infer_numeric_columns(df))
+            for col in numeric_columns:
+                df[col] = text_to_numeric(df[col])
+
+        report = None
+        if memory_mode != 'Off':
+            df, report = optimize_memory(df, memory_mode)
+        entry = cache.put(fingerprint, (df, report))
+    df, report = entry
+    return df, fingerprint, report
@@ -0,0 +1,118 @@
+import pandas as pd
+import numpy as np
+import shap
+import copy
+import joblib
+import os
+import shutil
+import tempfile
+from joblib import Parallel, delayed, parallel_config
+from sklearn.inspection import permutation_importance, partial_dependence
+from cache_utils import get_cache
+
+def with_n_jobs(ml_mod, n_jobs):
+    # Shallow copy (fitted trees are shared) that predicts with the given number of cores
+    if 'n_jobs' not in ml_mod.get_params():
+        return ml_mod
+    ml_mod = copy.copy(ml_mod)
+    ml_mod.n_jobs = n_jobs
+    return ml_mod
+
+def permutation_job(job, ml_mod, x, y, n_repeats, random_state, n_jobs):
+    # One repeat at a time, so the job can show its progress and stop when cancelled.
+    # Columns are shuffled on threads, which share the data instead of copying it to processes
+    rng = np.random.RandomState(random_state)
+    importances = []
+    with job.timed('Permutation importance', n_jobs), parallel_config(backend='threading'):
+        for r in range(n_repeats):
+            result = permutation_importance(ml_mod, x, y, n_repeats=1, random_state=rng, n_jobs=n_jobs)
+            importances.append(result.importances[:, 0])
+            job.report(r + 1, n_repeats, 'repeats')
+    return np.mean(importances, axis=0)
+
+def shap_rows(x, max_rows, sample, random_state=0):
+    # At most max_rows rows: a random sample (the same one every time) or the first ones
+    if len(x) <= max_rows:
+        return x
+    if sample:
+        return x.iloc[np.sort(np.random.default_rng(random_state).choice(len(x), max_rows, replace=False))]
+    return x.iloc[:max_rows]
+
+# Explainer of the last model file each worker process used, reused by the next chunks it runs
+worker_explainers = {}
+
+def shap_chunk(model_path, x, rows, approximate):
+    # Runs in a worker process: the model and the data are memory-mapped from disk, shared by every worker
+    explainer = worker_explainers.get(model_path)
+    if explainer is None:
+        worker_explainers.clear()
+        explainer = worker_explainers[model_path] = shap.TreeExplainer(joblib.load(model_path, mmap_mode='r'))
+    # The approximate (Saabas) values only follow the path of each row, much faster on deep trees
+    explanation = explainer(x[rows], check_additivity=False, approximate=approximate)
+    return rows, explanation.values, np.asarray(explanation.base_values)
+
+def shap_job(job, fingerprint, ml_mod, x, approximate=False, n_jobs=1, chunks_per_job=4):
+    # Chunks of rows are explained on a process pool and written into one array as they come back. The
+    # rows done so far are shared through job.partial, so the page can show them before the end. The
+    # result is cached, the page only slices it (e.g. by class)
+    columns = list(x.columns)
+    # Missing values (kept for histogram gradient boosting) must be NaN, which Arrow columns don't use
+    x = x.to_numpy(dtype='float64', na_value=np.nan)
+    chunks = [c for c in np.array_split(np.arange(len(x)), n_jobs * chunks_per_job) if len(c) > 0]
+
+    # The model and the data are written once to disk and memory-mapped by the workers, instead of
+    # being pickled to each task
+    folder = tempfile.mkdtemp(prefix='shap_')
+    try:
+        model_path, x_path = os.path.join(folder, 'model.joblib'), os.path.join(folder, 'x.joblib')
+        joblib.dump(ml_mod, model_path)
+        joblib.dump(x, x_path)
+        x_shared = joblib.load(x_path, mmap_mode='r')
+
+        job.report(0, len(chunks), 'row chunks explained')
+        with job.timed('SHAP values', n_jobs):
+            results = Parallel(n_jobs=n_jobs, return_as='generator_unordered')(
+                delayed(shap_chunk)(model_path, x_shared, rows, approximate) for rows in chunks
+            )
+            for i, (rows, values, base_values) in enumerate(results):
+                if i == 0:
+                    job.partial = {
+                        'values': np.empty((len(x),) + values.shape[1:], dtype=values.dtype),
+                        'base_values': np.empty((len(x),) + base_values.shape[1:], dtype=base_values.dtype),
+                        'done': np.zeros(len(x), dtype=bool),
+                        'data': x,
+                        'feature_names': columns
+                    }
+                job.partial['values'][rows] = values
+                job.partial['base_values'][rows] = base_values
+                # Rows are marked done once their values are written
+                job.partial['done'][rows] = True
+                job.report(i + 1, len(chunks), 'row chunks explained')
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return get_cache('training').put(fingerprint, partial_explanation(job.partial))
+
+def partial_explanation(partial):
+    # Explanation of the rows done so far
+    done = partial['done'].copy()
+    return shap.Explanation(
+        values=partial['values'][done],
+        base_values=partial['base_values'][done],
+        data=partial['data'][done],
+        feature_names=partial['feature_names']
+    )
+
+def partial_dependence_job(job, ml_mod, x, feature, n_jobs):
+    job.report(0, 1, 'computing')
+    # The grid values are written into the feature's column, which a sparse (one-hot) column refuses
+    if isinstance(x[feature].dtype, pd.SparseDtype):
+        x = x.astype({feature: x[feature].dtype.subtype})
+    # scikit-learn refuses integer columns for partial dependence
+    if pd.api.types.is_integer_dtype(x[feature]):
+        x = x.astype({feature: 'float64'})
+    # The predictions over the grid use the model's cores
+    with job.timed('Partial dependence', n_jobs):
+        result = partial_dependence(with_n_jobs(ml_mod, n_jobs), X=x, features=[feature])
+    job.report(1, 1, 'done')
+    return result
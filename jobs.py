@@ -0,0 +1,136 @@
+import streamlit as st
+import pandas as pd
+import threading
+import time
+import psutil
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from config import job_workers, job_poll_seconds, max_n_jobs
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    # A long task running on the worker pool. The task receives the job to report its progress
+    def __init__(self, key):
+        self.key = key
+        self.done_steps = 0
+        self.total_steps = 1
+        self.message = ''
+        self.future = None
+        self.timings = {}
+        # What a task shares of its result before it ends (e.g. the rows computed so far)
+        self.partial = None
+        self._cancel_event = threading.Event()
+
+    def run(self, fn, args, kwargs):
+        return fn(self, *args, **kwargs)
+
+    def report(self, done_steps, total_steps, message=''):
+        # Tasks call this regularly, it stops them as soon as the job is cancelled
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+        self.done_steps = done_steps
+        self.total_steps = total_steps
+        self.message = message
+
+    @contextmanager
+    def timed(self, step, n_jobs):
+        # CPU time (of the server and of its worker processes) over wall time tells how much faster the step
+        # ran thanks to its cores (approximate when other jobs run at the same time)
+        wall, (cpu, worker_cpu) = time.perf_counter(), cpu_times()
+        yield
+        wall = time.perf_counter() - wall
+        cpu, worker_cpu = [after - before for after, before in zip(cpu_times(), (cpu, worker_cpu))]
+        self.timings[step] = {
+            'Cores': n_jobs,
+            'Time (s)': wall,
+            'CPU time (s)': cpu + worker_cpu,
+            'Worker CPU time (s)': worker_cpu,
+            'Speedup': (cpu + worker_cpu) / max(wall, 1e-9)
+        }
+
+    def cancel(self):
+        self._cancel_event.set()
+        self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def done(self):
+        return self.future.done()
+
+    def progress(self):
+        return min(1.0, self.done_steps / max(self.total_steps, 1))
+
+def cpu_times():
+    # CPU time of this process and of its worker processes (the process pools of joblib stay alive between
+    # tasks, so they are read while they run; the ones that ended are counted in the process' children)
+    process = psutil.Process()
+    own = process.cpu_times()
+    workers = own.children_user + own.children_system if hasattr(own, 'children_user') else 0
+    for child in process.children(recursive=True):
+        try:
+            times = child.cpu_times()
+            workers += times.user + times.system
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return own.user + own.system, workers
+
+def session_n_jobs():
+    # Cores for a parallel step: the server limit, lowered by the session cap if set
+    return max(1, min(max_n_jobs, st.session_state.get('n_jobs_cap', max_n_jobs)))
+
+def show_timings(timings):
+    if timings:
+        with st.expander('**Click to see how long each step took**', expanded=False):
+            st.dataframe(pd.DataFrame(timings).T.round(2))
+
+@st.cache_resource
+def get_executor():
+    # Worker pool shared by every session of the server
+    return ThreadPoolExecutor(max_workers=job_workers, thread_name_prefix='job')
+
+def submit_job(slot, key, fn, *args, **kwargs):
+    # Each session runs at most one job per slot, a job with a new key replaces (and cancels) the old one
+    if 'jobs' not in st.session_state:
+        st.session_state.jobs = {}
+    job = st.session_state.jobs.get(slot)
+    if job is not None and job.key == key:
+        return job
+    if job is not None and not job.done():
+        job.cancel()
+
+    job = Job(key)
+    job.future = get_executor().submit(job.run, fn, args, kwargs)
+    st.session_state.jobs[slot] = job
+    return job
+
+def job_result(slot, text):
+    # Result of the job in the slot, or None (with its progress on the page) while it runs
+    job = st.session_state.jobs[slot]
+    if job.cancelled:
+        st.warning(f'{text} was cancelled.')
+        if st.button('Run again', key=f'job_button_rerun_{slot}'):
+            del st.session_state.jobs[slot]
+            st.rerun()
+        return None
+
+    if not job.done():
+        st.progress(job.progress(), text=f'{text}: {job.done_steps}/{job.total_steps} {job.message}')
+        if st.button('Cancel', key=f'job_button_cancel_{slot}'):
+            job.cancel()
+            st.rerun()
+        st.session_state.waiting_for_jobs = True
+        return None
+
+    # Errors of the task are raised here, on the page that needs the result
+    return job.future.result()
+
+def poll_jobs():
+    # Rerun the page (at the end of the script) while one of its results is still being computed
+    if st.session_state.get('waiting_for_jobs'):
+        st.session_state.waiting_for_jobs = False
+        time.sleep(job_poll_seconds)
+        st.rerun()
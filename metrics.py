@@ -0,0 +1,151 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+from sklearn.metrics import roc_auc_score, roc_curve, log_loss, average_precision_score, precision_recall_curve
+from cache_utils import get_cache, make_fingerprint
+from predictions import positive_class, positive_scores
+
+# Every metric of a split is derived from a few aggregates (residual sums, confusion matrix) computed in
+# one pass, and the metrics of a model are kept under its fingerprint: the options of the results page
+# only choose what to show
+
+def flat(values):
+    # Targets and predictions (series, one-column frames or arrays) as a flat array
+    return np.asarray(values).reshape(-1)
+
+def regression_metrics(y, predictions):
+    y = flat(y).astype('float64')
+    n = len(y)
+    residuals = predictions['residuals'].astype('float64')
+    sse = residuals @ residuals
+    centred = y - y.mean()
+    sst = centred @ centred
+    residual_variance = max(sse / n - residuals.mean() ** 2, 0)
+    # A constant target is perfectly explained only without errors, like in scikit-learn
+    if sst:
+        r2, evs = 1 - sse / sst, 1 - residual_variance * n / sst
+    else:
+        r2, evs = float(sse == 0), float(residual_variance == 0)
+    return {
+        'MAE': np.abs(residuals).sum() / n,
+        'MSE': sse / n,
+        'RMSE': np.sqrt(sse / n),
+        'R²': r2,
+        'Explained variance': evs
+    }
+
+def confusion_counts(y, y_pred):
+    # Confusion matrix over the sorted labels seen in the targets or the predictions, as one bincount
+    y, y_pred = flat(y), flat(y_pred)
+    labels = np.unique(np.concatenate([y, y_pred]))
+    k = len(labels)
+    codes = np.searchsorted(labels, y) * k + np.searchsorted(labels, y_pred)
+    return labels, np.bincount(codes, minlength=k * k).reshape(k, k)
+
+def classification_metrics(y, predictions):
+    labels, confusion = confusion_counts(y, predictions['pred'])
+    tp = np.diag(confusion)
+    support, predicted = confusion.sum(axis=1), confusion.sum(axis=0)
+    with np.errstate(all='ignore'):
+        # Classes never predicted (or never seen) score 0, like zero_division=0
+        precision = np.where(predicted > 0, tp / predicted, 0)
+        recall = np.where(support > 0, tp / support, 0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0)
+    weights = support / support.sum()
+    metrics = {
+        'labels': labels,
+        'confusion': confusion,
+        'Accuracy': tp.sum() / confusion.sum(),
+        'Precision (weighted)': precision @ weights,
+        'Recall (weighted)': recall @ weights,
+        'F1 Score (weighted)': f1 @ weights
+    }
+    # Precision, recall and F1 of the positive class for two classes, weighted by class otherwise
+    if len(labels) == 2:
+        positive = positive_class(labels)
+        metrics.update({'Precision': precision[positive], 'Recall': recall[positive], 'F1 Score': f1[positive]})
+    else:
+        metrics.update({'Precision': metrics['Precision (weighted)'], 'Recall': metrics['Recall (weighted)'], 'F1 Score': metrics['F1 Score (weighted)']})
+
+    # Curves and log loss come from the stored probabilities, when every target is a class of the model
+    if 'proba' not in predictions or not np.isin(flat(y), predictions['classes']).all():
+        return metrics
+    y, proba, classes = flat(y), predictions['proba'], predictions['classes']
+    # In float64: float32 probabilities would be clipped at the float32 epsilon and give another loss
+    # (the rows are normalized again, float32 rounding leaves their sums slightly off one)
+    proba_64 = proba.astype('float64')
+    metrics['Log Loss'] = log_loss(y, proba_64 / proba_64.sum(axis=1, keepdims=True), labels=classes)
+    if len(classes) == 2:
+        scores, positive = positive_scores(predictions)
+        y_binary = y == positive
+        if 0 < y_binary.sum() < len(y_binary):
+            metrics['ROC AUC'] = roc_auc_score(y_binary, scores)
+            metrics['ROC curve'] = roc_curve(y_binary, scores)[:2]
+            metrics['Average precision'] = average_precision_score(y_binary, scores)
+            metrics['PR curve'] = precision_recall_curve(y_binary, scores)[:2]
+    elif len(np.unique(y)) == len(classes):
+        metrics['ROC AUC'] = roc_auc_score(y, proba, multi_class='ovr', labels=classes)
+    return metrics
+
+def threshold_sweep(y, predictions):
+    # Confusion counts of a binary classifier at every threshold, from one sort of its scores: the rows
+    # with a score at or above a threshold are predicted positive, so the counts are cumulative sums
+    scores, positive = positive_scores(predictions)
+    order = np.argsort(-scores, kind='stable')
+    scores = scores[order]
+    is_positive = flat(y)[order] == positive
+    return {
+        'scores': scores,
+        'tp': np.cumsum(is_positive),
+        'fp': np.cumsum(~is_positive),
+        'positives': int(is_positive.sum()),
+        'negatives': int((~is_positive).sum()),
+        'positive': positive
+    }
+
+def sweep_counts(sweep, thresholds):
+    # True/false positives/negatives at the given thresholds, found by binary search
+    thresholds = np.atleast_1d(thresholds)
+    n_predicted = np.searchsorted(-sweep['scores'], -thresholds, side='right')
+    tp = np.where(n_predicted > 0, sweep['tp'][np.maximum(n_predicted - 1, 0)], 0)
+    fp = np.where(n_predicted > 0, sweep['fp'][np.maximum(n_predicted - 1, 0)], 0)
+    return tp, fp, sweep['positives'] - tp, sweep['negatives'] - fp
+
+def sweep_metrics(sweep, thresholds, cost_fp=1.0, cost_fn=1.0):
+    tp, fp, fn, tn = sweep_counts(sweep, thresholds)
+    with np.errstate(all='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0)
+    return pd.DataFrame({
+        'Threshold': np.atleast_1d(thresholds),
+        'Precision': precision,
+        'Recall': recall,
+        'F1 Score': f1,
+        'Accuracy': (tp + tn) / (tp + fp + fn + tn),
+        'Cost': cost_fp * fp + cost_fn * fn,
+        'TP': tp, 'FP': fp, 'FN': fn, 'TN': tn
+    })
+
+def cached_threshold_sweep(split):
+    # Sorted scores and cumulative counts of a split, computed once per model
+    key = make_fingerprint(st.session_state.model_fingerprint, 'threshold_sweep', split)
+    cache = get_cache('training')
+    sweep = cache.get(key)
+    if sweep is None:
+        y = st.session_state.y_train if split == 'train' else st.session_state.y_test
+        sweep = cache.put(key, threshold_sweep(y, st.session_state.predictions[split]))
+    return sweep
+
+def cached_metrics():
+    # Metrics of the train and test sets of the trained model, computed once per model from its stored predictions
+    key = make_fingerprint(st.session_state.model_fingerprint, 'metrics')
+    cache = get_cache('training')
+    metrics = cache.get(key)
+    if metrics is None:
+        compute = regression_metrics if st.session_state.problem_type == 'Regression' else classification_metrics
+        metrics = cache.put(key, {
+            'train': compute(st.session_state.y_train, st.session_state.predictions['train']),
+            'test': compute(st.session_state.y_test, st.session_state.predictions['test'])
+        })
+    return metrics
@@ -1,23 +1,30 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LinearRegression, LogisticRegression
-from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier, GradientBoostingRegressor, GradientBoostingClassifier
-from sklearn.preprocessing import OneHotEncoder, LabelEncoder
 from sklearn.utils.class_weight import compute_sample_weight
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score, explained_variance_score
-from sklearn.metrics import confusion_matrix, accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, roc_curve, auc, log_loss
 from sklearn.metrics import ConfusionMatrixDisplay
-from sklearn.inspection import PartialDependenceDisplay, permutation_importance, partial_dependence
+from sklearn.inspection import PartialDependenceDisplay
 import matplotlib.pyplot as plt
 import statsmodels.api as sm
 import shap
 import plotly.express as px
 import plotly.graph_objects as go
-from config import page_titles
+from config import page_titles, correlation_max_rows, contingency_max_levels
 from sidebar import sidebar_config
+from cache_utils import get_cache, make_fingerprint
+from training import training_fingerprint, cached_training
+from cross_validation import cross_validation_fingerprint, cached_cross_validation
+from jobs import submit_job, job_result, session_n_jobs, show_timings
+from inspection import permutation_job, shap_rows, shap_job, partial_explanation, partial_dependence_job
+from preprocessing import PreparationPipeline, sparse_columns
+from previews import paginated_dataframe
+from metrics import cached_metrics, cached_threshold_sweep, sweep_metrics
+from predictions import prediction_frame, positive_scores
+from charts import bin_counts, histogram_figure, grouped_box_statistics, box_figure, scatter_figure
+from profiling import is_numeric, cached_profile
+from correlation import cached_correlation, strongest_pairs, heatmap_matrix, cached_contingency
 import zipfile
+import pickle
 
 def introduction_text():
     st.header('**What can this app do?**')
@@ -35,18 +42,23 @@ def introduction_text():
         st.write('Upload a dataset on the sidebar')
     else:
         st.write('This is your dataset:')
+        # Numeric columns were already identified when the file was loaded
         df = st.session_state.df_original
-        for col in df.columns:
-            # Se mais de 90% dos valores únicos existentes forem números, considerar coluna como número
-            if len(pd.to_numeric(df[col], errors='coerce').dropna().unique()) >= 0.9*len(df[col].dropna().unique()):
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        st.dataframe(df, height = 300)
+        paginated_dataframe(df, 'table_original', st.session_state.dataset_fingerprint)
         st.write('These are the data types identified for your dataset:')
         st.write(df.dtypes)
-        st.session_state.df_original = df
+
+        report = st.session_state.get('memory_report')
+        if report is not None:
+            before = report['Before (MB)'].sum()
+            after = report['After (MB)'].sum()
+            st.write(f"Smaller data types reduced the memory used by your dataset from {before:.1f} MB to {after:.1f} MB ({before / max(after, 1e-9):.1f}x smaller)")
+            with st.expander('**Click to see the memory used by each column**', expanded=False):
+                st.dataframe(report.round(3))
 
 def exploratory_data_analysis():
-    df = st.session_state.df_original.copy()
+    # Read only here, so the data isn't copied
+    df = st.session_state.df_original
     st.header('Single variable analysis', divider='rainbow')
     col = st.columns(2)
     for c in range(len(col)):
@@ -57,13 +69,18 @@ def exploratory_data_analysis():
 
         with col[c]:
             st.subheader(var)
-            var_data = df[var]
-            if var_data.dtype in ['int64', 'float64']:
-                st.dataframe(var_data.describe(), height=150)
+            # Everything below comes from the profile of the column, computed once per dataset
+            profile = cached_profile(df, st.session_state.dataset_fingerprint, var)
+            st.caption(f"{profile['distinct']} distinct values, {profile['missing']} missing")
+            if profile['numeric']:
+                st.dataframe(profile['summary'], height=150)
+                if 'histogram' not in profile:
+                    continue
 
                 # Visualize the distribution (Histogram with Plotly)
-                fig = px.histogram(var_data, nbins=20, title=f'Distribution of {var}')
+                fig = histogram_figure(*profile['histogram'], var)
                 fig.update_layout(
+                    title=f'Distribution of {var}',
                     xaxis_title=var,
                     yaxis_title='Frequency',
                     template="seaborn",  # Choose a template (e.g., "plotly_dark", "ggplot2", etc.)
@@ -73,8 +90,9 @@ def exploratory_data_analysis():
                 st.plotly_chart(fig, use_container_width=True)
 
                 # Box plot to detect outliers
-                fig = px.box(var_data, title=f'Box plot of {var}')
+                fig = box_figure({var: profile['box']}, var)
                 fig.update_layout(
+                    title=f'Box plot of {var}',
                     yaxis_title=var,
                     template="seaborn",  # Choose a template (e.g., "plotly_dark", "ggplot2", etc.)
                     showlegend=True,
@@ -83,10 +101,14 @@ def exploratory_data_analysis():
                 st.plotly_chart(fig, use_container_width=True)
 
             else:
-                st.dataframe(var_data.value_counts(), height=150)
+                # The least frequent values are counted together
+                counts = profile['counts']
+                if profile['other']:
+                    counts = pd.concat([counts, pd.Series({'Other': profile['other']})]).rename_axis(var).rename('count')
+                st.dataframe(counts, height=150)
 
                 # Bar plot for category distribution
-                fig = px.bar(var_data.value_counts().reset_index(), x=var, y='count', 
+                fig = px.bar(counts.reset_index(), x=var, y='count', 
                             title=f'Count plot of {var}', labels={var: var, 'count': 'Frequency'})
                 fig.update_layout(
                     template="seaborn",  # Choose a template (e.g., "plotly_dark", "ggplot2", etc.)
@@ -96,7 +118,7 @@ def exploratory_data_analysis():
                 st.plotly_chart(fig, use_container_width=True)
 
                 # Pie chart for proportions
-                fig = px.pie(var_data.value_counts().reset_index(), values='count', names=var, 
+                fig = px.pie(counts.reset_index(), values='count', names=var, 
                             title=f'Pie chart of {var}', 
                             hole=0.3)
                 fig.update_traces(textinfo='percent+label')
@@ -114,10 +136,11 @@ def exploratory_data_analysis():
     var_data2 = df[var_name2]
 
     # Case 1: Both variables are numerical
-    if var_data1.dtype in ['int64', 'float64'] and var_data2.dtype in ['int64', 'float64']:
+    if is_numeric(var_data1) and is_numeric(var_data2):
         # Scatter plot to show relationship
-        fig = px.scatter(df, x=var_name1, y=var_name2, trendline="ols", title=f"Scatter plot of {var_name1} vs {var_name2} with linear regression line")
+        fig = scatter_figure(var_data1, var_data2)
         fig.update_layout(
+                    title=f"Scatter plot of {var_name1} vs {var_name2} with linear regression line",
                     xaxis_title=var_name1, 
                     yaxis_title=var_name2,
                     template="seaborn",  # Choose a template (e.g., "plotly_dark", "ggplot2", etc.)
@@ -131,10 +154,11 @@ def exploratory_data_analysis():
         print(f"Correlation coefficient between {var_name1} and {var_name2}: {corr}")
 
     # Case 2: One variable is numerical and the other is categorical
-    elif var_data1.dtype in ['int64', 'float64'] and var_data2.dtype in ['object', 'category']:
+    elif is_numeric(var_data1) and not is_numeric(var_data2):
         # Box plot
-        fig = px.box(df, x=var_name2, y=var_name1, title=f"Box plot of {var_name1} by {var_name2}")
+        fig = box_figure(grouped_box_statistics(var_data1, var_data2), var_name1)
         fig.update_layout(
+                    title=f"Box plot of {var_name1} by {var_name2}",
                     xaxis_title=var_name2, 
                     yaxis_title=var_name1,
                     template="seaborn",  # Choose a template (e.g., "plotly_dark", "ggplot2", etc.)
@@ -144,9 +168,11 @@ def exploratory_data_analysis():
         st.plotly_chart(fig, use_container_width=True)
     
     # Case 3: Both variables are categorical
-    elif var_data1.dtype in ['object', 'category'] and var_data2.dtype in ['object', 'category']:
+    elif not is_numeric(var_data1) and not is_numeric(var_data2):
         # Stacked bar plot
-        contingency_table = pd.crosstab(df[var_name1], df[var_name2])
+        contingency_table = cached_contingency(df, st.session_state.dataset_fingerprint, var_name1, var_name2)
+        if contingency_table.shape[0] > contingency_max_levels or contingency_table.shape[1] > contingency_max_levels:
+            st.caption(f'Only the {contingency_max_levels} most frequent levels of each variable are shown, the others are counted as Other.')
         fig = px.bar(contingency_table, barmode='stack', title=f"Stacked bar plot of {var_name1} and {var_name2}")
         fig.update_layout(
                     xaxis_title=var_name1, 
@@ -173,8 +199,9 @@ def exploratory_data_analysis():
     # Case 4: Same as 2 but the other way around
     else:
         # Box plot
-        fig = px.box(df, x=var_name1, y=var_name2, title=f"Box plot of {var_name2} by {var_name1}")
+        fig = box_figure(grouped_box_statistics(var_data2, var_data1), var_name2)
         fig.update_layout(
+                    title=f"Box plot of {var_name2} by {var_name1}",
                     xaxis_title=var_name1, 
                     yaxis_title=var_name2,
                     template="seaborn",  # Choose a template (e.g., "plotly_dark", "ggplot2", etc.)
@@ -184,11 +211,27 @@ def exploratory_data_analysis():
         st.plotly_chart(fig, use_container_width=True)
 
     st.header('Correlation analysis', divider='rainbow')
-    # Select only numeric columns
-    numeric_df = df.select_dtypes(include=['number'])
-    
-    # Calculate the correlation matrix
-    corr_matrix = numeric_df.corr()
+    method = st.session_state.correlation_method
+    kind = {"Cramér's V": 'categorical', 'Spearman': 'numeric or ordered'}.get(method, 'numeric')
+    corr_matrix = cached_correlation(
+        df,
+        st.session_state.dataset_fingerprint,
+        method,
+        st.session_state.correlation_rows == 'Sample of large datasets'
+    )
+    if len(corr_matrix) < 2:
+        st.write(f'{method} needs at least two {kind} variables.')
+        return
+    if st.session_state.correlation_rows == 'Sample of large datasets' and len(df) > correlation_max_rows:
+        st.caption(f'Computed on a random sample of {correlation_max_rows} of the {len(df)} observations.')
+
+    # Strongest relationships first, whatever the number of variables
+    st.dataframe(strongest_pairs(corr_matrix, st.session_state.correlation_top_k).round(3), hide_index=True)
+
+    full_size = len(corr_matrix)
+    corr_matrix = heatmap_matrix(corr_matrix, st.session_state.correlation_max_columns)
+    if len(corr_matrix) < full_size:
+        st.caption(f'The heatmap shows the {len(corr_matrix)} variables (out of {full_size}) most correlated with another one.')
     
     # Plot the heatmap
     fig = go.Figure(data=go.Heatmap(
@@ -197,22 +240,23 @@ def exploratory_data_analysis():
         y=corr_matrix.columns,
         colorscale='RdBu',  # Seaborn-like diverging colorscale
         colorbar=dict(title="Correlation Coefficient", ticksuffix="", outlinewidth=0),
-        zmin=-1, zmax=1,
+        zmin=0 if method == "Cramér's V" else -1, zmax=1,
         hovertemplate="X: %{x}<br>Y: %{y}<br>Correlation: %{z:.2f}<extra></extra>"
     ))
 
-    # Add correlation coefficients as text annotations
-    fig.update_traces(
-        text=corr_matrix.round(2).values,
-        texttemplate="%{text}",  # Format annotations
-        textfont=dict(size=10)#,  # Smaller text to avoid clutter
-        #hoverinfo='text'
-    )
+    # Add correlation coefficients as text annotations (unreadable on large heatmaps)
+    if len(corr_matrix) <= 25:
+        fig.update_traces(
+            text=corr_matrix.round(2).values,
+            texttemplate="%{text}",  # Format annotations
+            textfont=dict(size=10)#,  # Smaller text to avoid clutter
+            #hoverinfo='text'
+        )
 
     # Update layout
     fig.update_layout(
         title=dict(
-            text="Correlation Matrix of Numeric Variables",
+            text=f"{method} correlation matrix of {kind} variables",
             x=0,  # Left align the title
             xanchor='left'
         ),
@@ -262,102 +306,79 @@ def exploratory_data_analysis():
     # # Show Plot
     # st.plotly_chart(fig, use_container_width=True)
 
+def outlier_threshold():
+    # Each detector has its own slider on the sidebar
+    detector = st.session_state.get('outlier_detector', 'IQR')
+    if detector == 'Z-score':
+        return st.session_state.get('outlier_z_threshold', 3.0)
+    if detector == 'MAD':
+        return st.session_state.get('outlier_mad_threshold', 3.5)
+    if detector == 'Percentiles':
+        return st.session_state.get('outlier_percentile', 1.0)
+    return st.session_state.get('outlier_iqr_factor', 1.5)
+
 def data_preparation():
     st.header('Data preparation', divider='rainbow')
     st.subheader('Treating categorical columns')
-    df = st.session_state.df_original.copy()
-
-    # Identify categorical columns
-    categorical_columns = df.select_dtypes(include=['object', 'category']).columns
-    if st.session_state.categorical_treat == 'Remove columns':
-        df = df.drop(columns=categorical_columns)
-    elif st.session_state.categorical_treat == 'Label encoding':
-        # Apply Label Encoding to each categorical column
-        for col in categorical_columns:
-            le = LabelEncoder()
-            df[col] = le.fit_transform(df[col])
-    elif st.session_state.categorical_treat == 'One-hot encoding':
-        # Apply One-hot encoding to each categorical column
-        # Initialize the OneHotEncoder
-        encoder = OneHotEncoder(sparse_output=False, drop='if_binary')
-
-        # Apply one-hot encoding
-        encoded_data = encoder.fit_transform(df[categorical_columns])
-
-        # Create a DataFrame for the encoded columns
-        encoded_df = pd.DataFrame(
-            encoded_data,
-            columns=encoder.get_feature_names_out(categorical_columns)
-        )
 
-        # Combine with the original DataFrame (excluding the original categorical columns)
-        df = pd.concat([df.drop(columns=categorical_columns), encoded_df], axis=1)
-    
+    # The treatments are fitted once here and kept, so new data gets exactly the same ones
+    pipeline = PreparationPipeline(
+        st.session_state.categorical_treat,
+        st.session_state.missing_treat,
+        st.session_state.outlier_treat,
+        min_frequency=st.session_state.get('onehot_min_frequency', 1),
+        max_categories=st.session_state.get('onehot_max_categories', 0) or None,
+        outlier_detector=st.session_state.get('outlier_detector', 'IQR'),
+        outlier_threshold=outlier_threshold()
+    )
+    df_encoded, df_imputed, df = pipeline.fit_transform(
+        st.session_state.df_original,
+        st.session_state.dataset_fingerprint,
+        get_cache('preparation')
+    )
+
     st.write(f"After applying the method '{st.session_state.categorical_treat}' to the categorical columns, your dataset looks like:")
-    st.dataframe(df, height = 300)
+    paginated_dataframe(df_encoded, 'table_encoded', pipeline.stage_fingerprints[0])
 
-    st.subheader('Treating missing values')
-    if st.session_state.missing_treat == 'Remove observation':
-        df = df.dropna()
-    elif st.session_state.missing_treat == 'Imputation: mean':
-        df = df.fillna(df.mean())
-    elif st.session_state.missing_treat == 'Imputation: median':
-        df = df.fillna(df.median())
+    # Sparse columns only store their ones
+    encoded_columns = sparse_columns(df_encoded)
+    if encoded_columns:
+        sparse_mb = df_encoded[encoded_columns].memory_usage(index=False).sum() / 1024 ** 2
+        dense_mb = len(df_encoded) * len(encoded_columns) * 8 / 1024 ** 2
+        st.write(f"The {len(encoded_columns)} encoded columns take {sparse_mb:.2f} MB in sparse form instead of {dense_mb:.2f} MB dense ({dense_mb - sparse_mb:.2f} MB saved).")
 
+    st.subheader('Treating missing values')
     st.write(f"After applying the method '{st.session_state.missing_treat}' to the missing values, your dataset looks like:")
-    st.dataframe(df, height = 300)
+    paginated_dataframe(df_imputed, 'table_imputed', pipeline.stage_fingerprints[1])
 
     st.subheader('Treating outlier values')
-    if st.session_state.outlier_treat != 'Keep as-is':
-        # Find binary variables to exclude from outlier analysis
-        bin_vars = [c for c in df.columns if set(df[c].unique()) == {0, 1}]
-
-        # Calculate the first (25th percentile) and third (75th percentile) quartiles
-        Q1 = df.select_dtypes(include=['float64', 'int64']).quantile(0.25)
-        Q3 = df.select_dtypes(include=['float64', 'int64']).quantile(0.75)
-
-        # Calculate IQR (Interquartile Range)
-        IQR = Q3 - Q1
-
-        # Determine the lower and upper bounds for each column
-        lower_bound = Q1 - 1.5 * IQR
-        upper_bound = Q3 + 1.5 * IQR
-
-        # Initialize a mask that will indicate rows to keep (True means keep the row)
-        keep_rows_mask = pd.Series(True, index=df.index)
-
-        # Iterate through each numerical column (excluding one-hot encoded columns) to identify and remove outliers
-        for c in df.select_dtypes(include=['float64', 'int64']).columns:
-            if c not in bin_vars:  # Skip one-hot encoded columns
-                # Identify outliers (values outside the bounds)
-                outliers = (df[c] < lower_bound[c]) | (df[c] > upper_bound[c])
-
-                if st.session_state.outlier_treat == 'Remove observation':
-                    # Mark rows with outliers as False in the mask
-                    keep_rows_mask &= ~outliers  # Only keep rows that don't have outliers
-
-                    # Return the DataFrame with rows removed that had outliers in any numerical column
-                    df = df[keep_rows_mask]
-                
-                elif st.session_state.outlier_treat == 'Imputation: mean':
-                    # Replace outliers with the mean of the column
-                    df[c] = df[c].where(~outliers, df[c].mean())
-
-                elif st.session_state.outlier_treat == 'Imputation: median':
-                    # Replace outliers with the mean of the column
-                    df[c] = df[c].where(~outliers, df[c].median())
-        
     st.write(f"After applying the method '{st.session_state.outlier_treat}' to the outlier values, your dataset looks like:")
-    st.dataframe(df, height = 300)
+    paginated_dataframe(df, 'table_treated', pipeline.stage_fingerprints[2])
     st.session_state.treated = True
     st.session_state.df_treated = df
+    st.session_state.preparation_pipeline = pipeline
+    # Histogram gradient boosting can use the label-encoded columns as categories
+    st.session_state.label_encoded_columns = pipeline.categorical.columns if st.session_state.categorical_treat == 'Label encoding' else []
+    # Identifies the treated dataset: the original one and the options of every step
+    st.session_state.treated_fingerprint = pipeline.fingerprint
 
 def model_training():
-    df = st.session_state.df_treated.copy()
-    y = df[st.session_state.to_predict]
-    x = df[st.session_state.input_variables]
-
-    x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=(100-st.session_state.parameter_split_size)/100, random_state=st.session_state.parameter_random_state)
+    # Only histogram gradient boosting handles missing values itself
+    if st.session_state.model_to_use != 'Histogram gradient boosting' and st.session_state.df_treated[st.session_state.input_variables].isna().any().any():
+        st.warning('Your input variables still have missing values, which only histogram gradient boosting can handle. Choose another treatment for missing values on the data preparation page or use histogram gradient boosting.')
+        return
+
+    # Training only runs again when the data, the variables or a parameter changed
+    fingerprint = training_fingerprint()
+    result = cached_training(fingerprint)
+    if result is None:
+        return
+    x_train = result['x_train']
+    x_test = result['x_test']
+    y_train = result['y_train']
+    y_test = result['y_test']
+    df_y_train_pred = result['y_train_pred']
+    df_y_test_pred = result['y_test_pred']
 
     # Summarize the dataset
     st.header('Dataset split', divider='rainbow')
@@ -366,151 +387,71 @@ def model_training():
     rows, cols = x_test.shape
     st.write(f"Your test set has {rows} observations and {cols} input variables.")
 
-    # Start training
-    st.header('Model training', divider='rainbow')
-    if st.session_state.problem_type == 'Regression':
-        if st.session_state.model_to_use == 'Linear regression':
-            # Linear Regression does not require additional hyperparameters in most cases
-            ml_mod = LinearRegression()
-
-        elif st.session_state.model_to_use == 'Random forest':
-            ml_mod = RandomForestRegressor(
-                n_estimators=st.session_state.parameter_n_estimators,
-                random_state=st.session_state.parameter_random_state,
-                criterion=st.session_state.parameter_criterion,
-                max_depth=st.session_state.parameter_max_depth,
-                min_samples_split=st.session_state.parameter_min_samples_split,
-                min_samples_leaf=st.session_state.parameter_min_samples_leaf
-            )
-
-        elif st.session_state.model_to_use == 'Gradient boosting machines':
-            st.write('preparing GradientBoostingRegressor')
-            ml_mod = GradientBoostingRegressor(
-                loss=st.session_state.parameter_criterion,
-                n_estimators=st.session_state.parameter_n_estimators,
-                learning_rate=st.session_state.parameter_learning_rate,
-                max_depth=st.session_state.parameter_max_depth,
-                min_samples_split=st.session_state.parameter_min_samples_split,
-                min_samples_leaf=st.session_state.parameter_min_samples_leaf,
-                random_state=st.session_state.parameter_random_state
-            )
-
-    elif st.session_state.problem_type == 'Classification':
-        if st.session_state.model_to_use == 'Logistic regression':
-            ml_mod = LogisticRegression(
-                penalty=st.session_state.parameter_penalty,
-                C=st.session_state.parameter_c_value,
-                solver=st.session_state.parameter_solver,
-                random_state=st.session_state.parameter_random_state
-            )
-
-        elif st.session_state.model_to_use == 'Random forest':
-            if st.session_state.balance_strat == 'Balanced':
-                class_weights = 'balanced'
-            else:
-                class_weights = None
-            
-            ml_mod = RandomForestClassifier(
-                n_estimators=st.session_state.parameter_n_estimators,
-                random_state=st.session_state.parameter_random_state,
-                criterion=st.session_state.parameter_criterion,
-                max_depth=st.session_state.parameter_max_depth,
-                min_samples_split=st.session_state.parameter_min_samples_split,
-                min_samples_leaf=st.session_state.parameter_min_samples_leaf,
-                class_weight=class_weights
-            )
-
-        elif st.session_state.model_to_use == 'Gradient boosting machines':
-            #if st.session_state.balance_strat == 'Balanced':
-            #    class_weights = compute_sample_weight(
-            #        class_weight='balanced', y=y_train)
-            #else:
-            #    class_weights = None
-            class_weights = None
-
-            ml_mod = GradientBoostingClassifier(
-                loss=st.session_state.parameter_criterion,
-                n_estimators=st.session_state.parameter_n_estimators,
-                learning_rate=st.session_state.parameter_learning_rate,
-                max_depth=st.session_state.parameter_max_depth,
-                min_samples_split=st.session_state.parameter_min_samples_split,
-                min_samples_leaf=st.session_state.parameter_min_samples_leaf,
-                random_state=st.session_state.parameter_random_state
-            )
-
-    #if st.session_state.problem_type == 'Classification' and st.session_state.model_to_use == 'Gradient boosting machines':
-    #    ml_mod.fit(x_train, y_train, sample_weight=class_weights)
-    #else:
-    #    ml_mod.fit(x_train, y_train)
-    
-    ml_mod.fit(x_train, y_train)
-
-    y_train_pred = ml_mod.predict(x_train)
-    y_test_pred = ml_mod.predict(x_test)
+    if result['leaderboard'] is not None:
+        st.header('Hyperparameter search', divider='rainbow')
+        leaderboard = result['leaderboard']
+        best_parameters = {k: v for k, v in result['ml_mod'].get_params().items() if k in leaderboard.columns}
+        score = 'accuracy' if st.session_state.problem_type == 'Classification' else 'R²'
+        st.write(f"The search ran {len(leaderboard)} cross-validated evaluations (scored by {score}). The best configuration, {best_parameters}, was trained again on the whole training set and is used from now on.")
+        st.dataframe(leaderboard, height = 300)
 
+    st.header('Model training', divider='rainbow')
     st.write('Your model has finished training, see below the predictions for the training and tests:')
+    if result['reused_trees']:
+        st.write(f"Only the number of estimators changed, so {result['reused_trees']} trees of your previous model were reused.")
     col = st.columns(2)
     with col[0]:
         st.subheader('Train set')
-        df_y_train_pred = pd.DataFrame(y_train_pred, columns=['pred'])
-        x_train = x_train.reset_index(drop=True)
-        y_train = y_train.reset_index(drop=True)
-        df_y_train_pred = df_y_train_pred.reset_index(drop=True)
-        st.dataframe(pd.concat([x_train, y_train, df_y_train_pred], axis=1), height = 300)
+        paginated_dataframe([x_train, y_train, df_y_train_pred], 'table_train', (fingerprint, 'train'))
 
     with col[1]:
         st.subheader('Test set')
-        df_y_test_pred = pd.DataFrame(y_test_pred, columns=['pred'])
-        x_test = x_test.reset_index(drop=True)
-        y_test = y_test.reset_index(drop=True)
-        df_y_test_pred = df_y_test_pred.reset_index(drop=True)
-        st.dataframe(pd.concat([x_test, y_test, df_y_test_pred], axis=1), height = 300)
+        paginated_dataframe([x_test, y_test, df_y_test_pred], 'table_test', (fingerprint, 'test'))
+
+    show_timings(result['timings'])
 
     st.session_state.trained = True
+    st.session_state.model_fingerprint = fingerprint
     st.session_state.x_train = x_train
     st.session_state.x_test = x_test
     st.session_state.y_train = y_train
     st.session_state.y_test = y_test
     st.session_state.y_train_pred = df_y_train_pred
     st.session_state.y_test_pred = df_y_test_pred
-    st.session_state.ml_mod = ml_mod
+    st.session_state.predictions = result['predictions']
+    st.session_state.ml_mod = result['ml_mod']
+    st.session_state.hyperparameter_leaderboard = result['leaderboard']
 
 def result_analysis():
     st.header('Analysis of result metrics', divider='rainbow')
     
+    # Every metric of the model is computed once, the options only choose which ones are shown
+    all_metrics = cached_metrics()
     col = st.columns(2)
     for c in range(len(col)):
         with col[c]:
             if c == 0:
                 st.subheader('Train set')
-                y = st.session_state.y_train
-                y_pred = st.session_state.y_train_pred
+                metrics = all_metrics['train']
             else:
                 st.subheader('Test set')
-                y = st.session_state.y_test
-                y_pred = st.session_state.y_test_pred
+                metrics = all_metrics['test']
             
             if st.session_state.problem_type == 'Regression':
                 if st.session_state.mae_analysis == 'Yes':
-                    mae = mean_absolute_error(y, y_pred)
-                    st.write(f"Mean Absolute Error (MAE): {mae:.4f}")
+                    st.write(f"Mean Absolute Error (MAE): {metrics['MAE']:.4f}")
                 if st.session_state.mse_analysis == 'Yes':
-                    mse = mean_squared_error(y, y_pred)
-                    st.write(f"Mean Squared Error (MSE): {mse:.4f}")
+                    st.write(f"Mean Squared Error (MSE): {metrics['MSE']:.4f}")
                 if st.session_state.rmse_analysis == 'Yes':
-                    rmse = np.sqrt(mean_squared_error(y, y_pred))
-                    st.write(f"Root Mean Squared Error (RMSE): {rmse:.4f}")
+                    st.write(f"Root Mean Squared Error (RMSE): {metrics['RMSE']:.4f}")
                 if st.session_state.r2_analysis == 'Yes':
-                    r2 = r2_score(y, y_pred)
-                    st.write(f"R² Score: {r2:.4f}")
+                    st.write(f"R² Score: {metrics['R²']:.4f}")
                 if st.session_state.evs_analysis == 'Yes':
-                    evs = explained_variance_score(y, y_pred)
-                    st.write(f"Explained Variance Score: {evs:.4f}")
+                    st.write(f"Explained Variance Score: {metrics['Explained variance']:.4f}")
             else:
                 if st.session_state.conf_analysis == 'Yes':
-                    # Calculate the confusion matrix
-                    conf_matrix = confusion_matrix(y, y_pred)
-                    labels = [f"Class {i}" for i in range(len(conf_matrix))]  # Modify based on your class labels
+                    conf_matrix = metrics['confusion']
+                    labels = [f"Class {label}" for label in metrics['labels']]
 
                     # Create a heatmap with Plotly
                     fig = go.Figure(
@@ -543,23 +484,21 @@ def result_analysis():
                     st.plotly_chart(fig, use_container_width=True, key=f'confusion_graph_{c}')
 
                 if st.session_state.accuracy_analysis == 'Yes':
-                    acc = accuracy_score(y, y_pred)
-                    st.write(f"Accuracy: {acc:.4f}")
+                    st.write(f"Accuracy: {metrics['Accuracy']:.4f}")
                 if st.session_state.precision_analysis == 'Yes':
-                    prec = precision_score(y, y_pred)
-                    st.write(f"Precision: {prec:.4f}")
+                    st.write(f"Precision: {metrics['Precision']:.4f}")
                 if st.session_state.recall_analysis == 'Yes':
-                    rec = recall_score(y, y_pred)
-                    st.write(f"Recall: {rec:.4f}")
+                    st.write(f"Recall: {metrics['Recall']:.4f}")
                 if st.session_state.f1_analysis == 'Yes':
-                    f1 = f1_score(y, y_pred)
-                    st.write(f"F1 Score: {f1:.4f}")
-                if st.session_state.auc_analysis == 'Yes':
-                    roc_auc = roc_auc_score(y, y_pred, multi_class='ovr')  # Adjust for multi-class
+                    st.write(f"F1 Score: {metrics['F1 Score']:.4f}")
+                if st.session_state.auc_analysis == 'Yes' and 'ROC AUC' in metrics:
+                    roc_auc = metrics['ROC AUC']
                     st.write(f"ROC AUC Score: {roc_auc:.4f}")
-
-                    fpr, tpr, _ = roc_curve(y, y_pred)
-                    roc_auc = auc(fpr, tpr)
+                if st.session_state.auc_analysis == 'Yes' and 'ROC curve' not in metrics:
+                    st.write('The ROC and precision-recall curves are only shown for two classes.')
+                elif st.session_state.auc_analysis == 'Yes':
+                    # Curves of the predicted probabilities of the positive class
+                    fpr, tpr = metrics['ROC curve']
 
                     fig = go.Figure()
                     fig.add_trace(go.Scatter(x=fpr, y=tpr, mode='lines', name=f"ROC Curve (AUC = {roc_auc:.2f})"))
@@ -573,10 +512,88 @@ def result_analysis():
                         legend = dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
                     )
                     st.plotly_chart(fig, use_container_width=True, key=f'auc_graph_{c}')
+
+                    precision, recall = metrics['PR curve']
+                    fig = go.Figure()
+                    fig.add_trace(go.Scatter(x=recall, y=precision, mode='lines', name=f"Precision-recall curve (AP = {metrics['Average precision']:.2f})"))
+                    fig.update_layout(
+                        title="Precision-recall Curve", 
+                        xaxis_title="Recall", 
+                        yaxis_title="Precision",
+                        template="seaborn",  # Choose a template (e.g., "plotly_dark", "ggplot2", etc.)
+                        showlegend=True,
+                        legend = dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+                    )
+                    st.plotly_chart(fig, use_container_width=True, key=f'pr_graph_{c}')
                 
-                if st.session_state.logloss_analysis == 'Yes':
-                    logloss = log_loss(y, y_pred)
-                    st.write(f"Log Loss: {logloss:.4f}")
+                if st.session_state.logloss_analysis == 'Yes' and 'Log Loss' in metrics:
+                    st.write(f"Log Loss: {metrics['Log Loss']:.4f}")
+
+    # Decision threshold of a binary classifier: the counts at every threshold come from the sorted scores
+    # stored at training, so moving the slider doesn't use the model
+    if st.session_state.get('threshold_analysis') == 'Yes' and len(st.session_state.predictions['test'].get('classes', [])) == 2:
+        st.header('Decision threshold', divider='rainbow')
+        threshold = st.session_state.decision_threshold
+        cost_fp, cost_fn = st.session_state.cost_false_positive, st.session_state.cost_false_negative
+        sweep = cached_threshold_sweep('test')
+        grid = sweep_metrics(sweep, np.linspace(0, 1, 101), cost_fp, cost_fn)
+        chosen = sweep_metrics(sweep, threshold, cost_fp, cost_fn).iloc[0]
+        best = grid.loc[grid['Cost'].idxmin()]
+        negative = [c for c in st.session_state.predictions['test']['classes'] if c != sweep['positive']][0]
+        st.write(f"On the test set, predicting class {sweep['positive']} when its probability is at least {threshold:.2f} gives a precision of {chosen['Precision']:.4f}, a recall of {chosen['Recall']:.4f}, an F1 score of {chosen['F1 Score']:.4f} and an accuracy of {chosen['Accuracy']:.4f}.")
+        st.write(f"With these costs, its errors cost {chosen['Cost']:.1f}. The lowest cost ({best['Cost']:.1f}) is reached with a threshold of {best['Threshold']:.2f}.")
+
+        col = st.columns(2)
+        with col[0]:
+            fig = go.Figure()
+            for metric in ['Precision', 'Recall', 'F1 Score', 'Accuracy']:
+                fig.add_trace(go.Scatter(x=grid['Threshold'], y=grid[metric], mode='lines', name=metric))
+            fig.add_vline(x=threshold, line_dash='dash')
+            fig.update_layout(
+                title="Metrics by decision threshold", 
+                xaxis_title="Threshold", 
+                yaxis_title="Score",
+                template="seaborn",  # Choose a template (e.g., "plotly_dark", "ggplot2", etc.)
+                showlegend=True,
+                legend = dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+            )
+            st.plotly_chart(fig, use_container_width=True, key='threshold_graph')
+        with col[1]:
+            conf_matrix = np.array([[chosen['TN'], chosen['FP']], [chosen['FN'], chosen['TP']]], dtype=int)
+            labels = [f"Class {negative}", f"Class {sweep['positive']}"]
+            fig = go.Figure(
+                data=go.Heatmap(
+                    z=conf_matrix,
+                    x=labels,
+                    y=labels,
+                    colorscale="Blues",
+                    colorbar=dict(title="Count"),
+                    text=conf_matrix,
+                    texttemplate="%{text}",
+                    textfont=dict(size=12)
+                )
+            )
+            fig.update_layout(
+                title=f"Confusion Matrix at threshold {threshold:.2f}",
+                xaxis_title="Predicted Label",
+                yaxis_title="True Label",
+                template="seaborn"
+            )
+            st.plotly_chart(fig, use_container_width=True, key='threshold_confusion_graph')
+
+    # Cross-validation: every observation is predicted once by a model that didn't see it
+    if st.session_state.get('evaluation_mode', 'Train/test split') != 'Train/test split':
+        st.header('Cross-validation', divider='rainbow')
+        result = cached_cross_validation(cross_validation_fingerprint())
+        if result is not None:
+            st.write(f"Metrics of the {st.session_state.cv_folds} folds ({st.session_state.evaluation_mode}), each evaluated on the observations left out of its training:")
+            st.dataframe(result['folds'].round(4))
+            st.write('Metrics of the out-of-fold predictions of all the observations:')
+            for metric, value in result['oof_metrics'].items():
+                st.write(f"{metric}: {value:.4f}")
+            show_timings(result['timings'])
+            st.session_state.oof_y = result['y']
+            st.session_state.oof_pred = result['oof_pred']
 
 def model_interpretation():
     
@@ -630,11 +647,11 @@ def model_interpretation():
         coeffs_df = coeffs_df.sort_values("Odds Ratio", key=abs, ascending=False)
         st.dataframe(coeffs_df)
 
-    elif st.session_state.model_to_use in ['Random forest', 'Gradient boosting machines']:
+    elif st.session_state.model_to_use in ['Random forest', 'Gradient boosting machines', 'Histogram gradient boosting']:
         st.header("Machine learning model analysis", divider='rainbow')
 
-        # Traditional feature importance
-        if st.session_state.traditional_imp == 'Yes':
+        # Traditional feature importance (histogram gradient boosting has none, its importance comes from permutations)
+        if hasattr(ml_mod, 'feature_importances_') and st.session_state.traditional_imp == 'Yes':
             st.subheader("Traditional Feature Importance")
             feature_importance = pd.Series(ml_mod.feature_importances_, index=x_train.columns)
             feature_importance = feature_importance.sort_values(ascending=False)
@@ -647,86 +664,150 @@ def model_interpretation():
         # Permutation importance
         if st.session_state.permutation_imp == 'Yes':
             st.subheader("Permutation Importance")
-            perm_importance = permutation_importance(ml_mod, x_test, y_test, n_repeats=10, random_state=st.session_state.parameter_random_state)
-            perm_importance_df = pd.DataFrame({
-                "Feature": x_train.columns,
-                "Importance": perm_importance.importances_mean
-            }).sort_values("Importance", ascending=False)
-            
-            # Plot permutation importance using Plotly
-            fig = go.Figure([go.Bar(x=perm_importance_df['Feature'], y=perm_importance_df['Importance'], marker_color='indianred')])
-            fig.update_layout(title="Permutation Feature Importance", xaxis_title="Features", yaxis_title="Importance", template="seaborn")
-            st.plotly_chart(fig)
+            submit_job(
+                'permutation_importance',
+                st.session_state.model_fingerprint,
+                permutation_job,
+                ml_mod, x_test, y_test, 10, st.session_state.parameter_random_state, session_n_jobs()
+            )
+            importances_mean = job_result('permutation_importance', 'Computing permutation importance')
+            if importances_mean is not None:
+                perm_importance_df = pd.DataFrame({
+                    "Feature": x_train.columns,
+                    "Importance": importances_mean
+                }).sort_values("Importance", ascending=False)
+
+                # Plot permutation importance using Plotly
+                fig = go.Figure([go.Bar(x=perm_importance_df['Feature'], y=perm_importance_df['Importance'], marker_color='indianred')])
+                fig.update_layout(title="Permutation Feature Importance", xaxis_title="Features", yaxis_title="Importance", template="seaborn")
+                st.plotly_chart(fig)
 
         # SHAP values
         if st.session_state.shap_analysis == 'Yes':
             st.subheader("SHAP Values")
-            explainer = shap.TreeExplainer(ml_mod)
-            shap_values = explainer.shap_values(x_test)
-            explanation = explainer(x_test)  # New style
-
-            # Classification: Handle multi-class SHAP values
-            if st.session_state.problem_type == 'Classification' and st.session_state.model_to_use == 'Random forest':
-                # Number of classes
-                num_classes = len(explanation.values[0][0])
-                st.write("For classification, select which class to analyze SHAP values.")
-
-                # Interactive class selection
-                class_index = st.selectbox(
-                    "Select class to analyze:",
-                    options=list(range(num_classes)),
-                    format_func=lambda x: f"Class {x}"
-                )
+            # Computed once per model and settings (for every class at once), and kept for every session
+            sample = st.session_state.shap_rows == 'Random sample'
+            approximate = st.session_state.shap_algorithm != 'Exact'
+            shap_fingerprint = make_fingerprint(st.session_state.model_fingerprint, 'shap', st.session_state.shap_max_rows, sample, approximate)
+            explanation = get_cache('training').get(shap_fingerprint)
+            n_rows = min(len(x_test), st.session_state.shap_max_rows)
+            if explanation is None:
+                submit_job('shap', shap_fingerprint, shap_job, shap_fingerprint, ml_mod, shap_rows(x_test, st.session_state.shap_max_rows, sample), approximate, session_n_jobs())
+                explanation = job_result('shap', 'Computing SHAP values')
+
+            # While the values are computed, the observations explained so far can already be shown
+            partial = st.session_state.jobs['shap'].partial if explanation is None and 'shap' in st.session_state.get('jobs', {}) else None
+            if partial is not None:
+                if 'shap_partial' not in st.session_state:
+                    st.session_state.shap_partial = False
+                if st.checkbox('Show the observations explained so far', key='shap_partial'):
+                    explanation = partial_explanation(partial)
+                    st.write(f"Partial results: {len(explanation.values)} of the {n_rows} observations are explained so far.")
+
+            if explanation is not None:
+                if n_rows < len(x_test):
+                    st.write(f"The values explain {'a random sample of' if sample else 'the first'} {n_rows} of the {len(x_test)} test observations. Explain more of them (on the sidebar) for a more precise picture, at the cost of a longer computation.")
+                if approximate:
+                    st.write("The values are approximate (Saabas): much faster to compute, but they only follow the path of each observation in the trees and can misattribute the effect of interacting variables.")
+
+                # Classification: Handle multi-class SHAP values (one set of values per class)
+                if explanation.values.ndim == 3:
+                    # Number of classes
+                    num_classes = len(explanation.values[0][0])
+                    st.write("For classification, select which class to analyze SHAP values.")
+
+                    # Interactive class selection, it only selects a slice of the computed values
+                    if st.session_state.get('shap_class') not in range(num_classes):
+                        st.session_state.shap_class = 0
+                    classes = getattr(ml_mod, 'classes_', range(num_classes))
+                    class_index = st.selectbox(
+                        "Select class to analyze:",
+                        options=list(range(num_classes)),
+                        format_func=lambda x: f"Class {classes[x]}",
+                        key='shap_class'
+                    )
 
-                # Extract SHAP values for the selected class
-                shap_class_values = explanation.values[:, :, class_index]
-
-                # Beeswarm plot for the selected class
-                st.write(f"Beeswarm plot for class {class_index}:")
-                shap.plots.beeswarm(
-                    shap.Explanation(
-                        values=shap_class_values,
-                        base_values=explanation.base_values[:, class_index],
-                        data=explanation.data,
-                        feature_names=explanation.feature_names
-                    ),
-                    max_display=20,
-                    show=False
-                )
-                st.pyplot(bbox_inches="tight")
+                    # Extract SHAP values for the selected class
+                    shap_class_values = explanation.values[:, :, class_index]
+
+                    # Beeswarm plot for the selected class
+                    st.write(f"Beeswarm plot for class {classes[class_index]}:")
+                    shap.plots.beeswarm(
+                        shap.Explanation(
+                            values=shap_class_values,
+                            base_values=explanation.base_values[:, class_index],
+                            data=explanation.data,
+                            feature_names=explanation.feature_names
+                        ),
+                        max_display=20,
+                        show=False
+                    )
+                    st.pyplot(plt.gcf(), clear_figure=True, bbox_inches="tight")
 
-            else:
-                shap.plots.beeswarm(explanation, max_display=20, show=False)
-                st.pyplot(bbox_inches='tight')
+                else:
+                    shap.plots.beeswarm(explanation, max_display=20, show=False)
+                    st.pyplot(plt.gcf(), clear_figure=True, bbox_inches="tight")
 
         # Partial dependence plots
         if st.session_state.partial_dep_plot == 'Yes':
             feature_to_plot = [st.session_state.var_analysis]
 
             # Compute Partial Dependence
-            pdp_result = partial_dependence(ml_mod, X=x_test, features=feature_to_plot)
+            submit_job(
+                'partial_dependence',
+                make_fingerprint(st.session_state.model_fingerprint, feature_to_plot),
+                partial_dependence_job,
+                ml_mod, x_test, feature_to_plot[0], session_n_jobs()
+            )
+            pdp_result = job_result('partial_dependence', 'Computing partial dependence')
 
-            # Extract the grid and average predictions for the feature
-            feature_values = pdp_result['grid_values'][0]
-            average_predictions = pdp_result['average'][0]
+            if pdp_result is not None:
+                # Extract the grid and average predictions for the feature
+                feature_values = pdp_result['grid_values'][0]
+                average_predictions = pdp_result['average'][0]
 
-            # Plot using Plotly
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(x=feature_values, y=average_predictions, mode="lines", name="Partial Dependence"))
+                # Plot using Plotly
+                fig = go.Figure()
+                fig.add_trace(go.Scatter(x=feature_values, y=average_predictions, mode="lines", name="Partial Dependence"))
 
-            fig.update_layout(
-                title="Partial Dependence Plot",
-                xaxis_title=f"Feature: {feature_to_plot[0]}",
-                yaxis_title="Predicted Outcome",
-                template="seaborn"
-            )
-            st.plotly_chart(fig)
+                fig.update_layout(
+                    title="Partial Dependence Plot",
+                    xaxis_title=f"Feature: {feature_to_plot[0]}",
+                    yaxis_title="Predicted Outcome",
+                    template="seaborn"
+                )
+                st.plotly_chart(fig)
+
+        # Time taken by the inspection steps and the speedup from their cores
+        timings = {}
+        for slot in ['permutation_importance', 'shap', 'partial_dependence']:
+            if slot in st.session_state.get('jobs', {}) and st.session_state.jobs[slot].done():
+                timings.update(st.session_state.jobs[slot].timings)
+        show_timings(timings)
+
+    # Errors on the test set, from the predictions stored at training
+    predictions = st.session_state.predictions['test']
+    if 'residuals' in predictions:
+        st.header('Prediction errors', divider='rainbow')
+        fig = histogram_figure(*bin_counts(predictions['residuals'], 30), 'Residuals')
+        fig.update_layout(title="Residuals on the test set (actual - predicted)", xaxis_title="Residual", yaxis_title="Frequency", template="seaborn")
+        st.plotly_chart(fig)
+    elif 'proba' in predictions and len(predictions['classes']) == 2:
+        st.header('Predicted probabilities', divider='rainbow')
+        scores, positive = positive_scores(predictions)
+        edges = np.linspace(0, 1, 21)
+        fig = go.Figure()
+        for label in predictions['classes']:
+            counts, _ = bin_counts(scores[np.asarray(y_test) == label], edges)
+            fig.add_trace(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges), name=f"Class {label}", opacity=0.6))
+        fig.update_layout(title=f"Predicted probability of class {positive} on the test set, by actual class", xaxis_title="Probability", yaxis_title="Frequency", barmode='overlay', template="seaborn")
+        st.plotly_chart(fig)
 
 def exercise_summary():
     st.write('During this exercise you followed a series of steps that are part of a data scientist job. In this page you will find a short summary of each step')
     st.header('Input data', divider='rainbow')
     st.write('You started by uploading a dataset with a series of variables:')
-    st.dataframe(st.session_state.df_original, height = 300)
+    paginated_dataframe(st.session_state.df_original, 'table_summary_original', st.session_state.dataset_fingerprint)
     st.header('Exploratory data analysis', divider='rainbow')
     st.write("Next, you analyzed different variables individually and in pairs, using different visualizations depending on the variable's type. You also examined the correlation matrix to find insights from the data")
     st.header('Data preparation', divider='rainbow')
@@ -735,7 +816,7 @@ def exercise_summary():
     st.write(f"-For missing values, you decided to {st.session_state.missing_treat}")
     st.write(f"-For oultier values, you decided to {st.session_state.outlier_treat}")
     st.write('This was the treated dataset that resulted from your decisions:')
-    st.dataframe(st.session_state.df_treated, height = 300)
+    paginated_dataframe(st.session_state.df_treated, 'table_summary_treated', st.session_state.treated_fingerprint)
     st.header('Model training', divider='rainbow')
     st.write("Next, you started to work on training the predictive model")
     st.write(f"You identified your problem as a {st.session_state.problem_type} problem")
@@ -746,14 +827,17 @@ def exercise_summary():
     st.write(f"As input variables you chose: {input_vars}")
     st.write(f"You selected the model {st.session_state.model_to_use} for your problem")
     st.write(f"You were able to play with different parameters to set up the model")
+    if st.session_state.get('hyperparameter_leaderboard') is not None:
+        st.write(f"You ran a hyperparameter search over {len(st.session_state.hyperparameter_leaderboard)} cross-validated evaluations and kept the best configuration")
     st.header('Result analysis', divider='rainbow')
     st.write("After training the model you started examining its results")
+    metrics = cached_metrics()
     if st.session_state.problem_type == "Regression":
-        st.write(f"Your model had a mean squared error of {mean_squared_error(st.session_state.y_train, st.session_state.y_train_pred):.4f} in the training set and {mean_squared_error(st.session_state.y_test, st.session_state.y_test_pred):.4f} in the test set")
+        st.write(f"Your model had a mean squared error of {metrics['train']['MSE']:.4f} in the training set and {metrics['test']['MSE']:.4f} in the test set")
     else:
-        st.write(f"Your model had an accuracy of {accuracy_score(st.session_state.y_train, st.session_state.y_train_pred):.4f} in the training set and {accuracy_score(st.session_state.y_test, st.session_state.y_test_pred):.4f} in the test set")
-        st.write(f"Your model had a precision of {precision_score(st.session_state.y_train, st.session_state.y_train_pred, average='weighted'):.4f} in the training set and {precision_score(st.session_state.y_test, st.session_state.y_test_pred, average='weighted'):.4f} in the test set")
-        st.write(f"Your model had a recall of {recall_score(st.session_state.y_train, st.session_state.y_train_pred, average='weighted'):.4f} in the training set and {recall_score(st.session_state.y_test, st.session_state.y_test_pred, average='weighted'):.4f} in the test set")
+        st.write(f"Your model had an accuracy of {metrics['train']['Accuracy']:.4f} in the training set and {metrics['test']['Accuracy']:.4f} in the test set")
+        st.write(f"Your model had a precision of {metrics['train']['Precision (weighted)']:.4f} in the training set and {metrics['test']['Precision (weighted)']:.4f} in the test set")
+        st.write(f"Your model had a recall of {metrics['train']['Recall (weighted)']:.4f} in the training set and {metrics['test']['Recall (weighted)']:.4f} in the test set")
     st.header('Download results', divider='rainbow')
     st.write("You can now download the results of the exercise")
 
@@ -766,10 +850,16 @@ def exercise_summary():
         st.session_state.y_train.to_csv('y_train.csv', index=False)
         st.session_state.x_test.to_csv('X_test.csv', index=False)
         st.session_state.y_test.to_csv('y_test.csv', index=False)
-        st.session_state.y_train_pred.to_csv('pred_train.csv', index=False)
-        st.session_state.y_test_pred.to_csv('pred_test.csv', index=False)
+        prediction_frame(st.session_state.predictions['train']).to_csv('pred_train.csv', index=False)
+        prediction_frame(st.session_state.predictions['test']).to_csv('pred_test.csv', index=False)
 
-        list_files = ['dataset_original.csv', 'dataset_treated.csv', 'X_train.csv', 'y_train.csv', 'X_test.csv', 'y_test.csv', 'pred_train.csv', 'pred_test.csv']
+        # The fitted preparation and model, to score new data outside the app
+        with open('preparation_pipeline.pkl', 'wb') as f:
+            pickle.dump(st.session_state.preparation_pipeline, f)
+        with open('model.pkl', 'wb') as f:
+            pickle.dump(st.session_state.ml_mod, f)
+
+        list_files = ['dataset_original.csv', 'dataset_treated.csv', 'X_train.csv', 'y_train.csv', 'X_test.csv', 'y_test.csv', 'pred_train.csv', 'pred_test.csv', 'preparation_pipeline.pkl', 'model.pkl']
         with zipfile.ZipFile('exercise.zip', 'w') as zipF:
             for file in list_files:
                 zipF.write(file, compress_type=zipfile.ZIP_DEFLATED)
@@ -784,36 +874,8 @@ def exercise_summary():
 
 
     if st.session_state.predict_output:
-        df = st.session_state.df_to_predict.copy()
-        # Repeat treatment of the dataset -> don't treat for missing values and for outliers
-        # Identify categorical columns
-        categorical_columns = df.select_dtypes(include=['object', 'category']).columns
-        if st.session_state.categorical_treat == 'Remove columns':
-            df = df.drop(columns=categorical_columns)
-        elif st.session_state.categorical_treat == 'Label encoding':
-            # Apply Label Encoding to each categorical column
-            for col in categorical_columns:
-                le = LabelEncoder()
-                df[col] = le.fit_transform(df[col])
-        elif st.session_state.categorical_treat == 'One-hot encoding':
-            # Apply One-hot encoding to each categorical column
-            # Initialize the OneHotEncoder
-            encoder = OneHotEncoder(sparse_output=False, drop=None)
-
-            # Apply one-hot encoding
-            encoded_data = encoder.fit_transform(df[categorical_columns])
-
-            # Create a DataFrame for the encoded columns
-            encoded_df = pd.DataFrame(
-                encoded_data,
-                columns=encoder.get_feature_names_out(categorical_columns)
-            )
-
-            # Combine with the original DataFrame (excluding the original categorical columns)
-            df = pd.concat([df.drop(columns=categorical_columns), encoded_df], axis=1)
-        
-        # Get input variables
-        x = df[st.session_state.input_variables]
+        # Same treatment as the training data (fitted on it), with the input variables in the model's order
+        x = st.session_state.preparation_pipeline.transform(st.session_state.df_to_predict, st.session_state.input_variables)
 
         # Predict
         y = st.session_state.ml_mod.predict(x)
@@ -0,0 +1,38 @@
+import pandas as pd
+import numpy as np
+from sklearn.base import is_classifier
+
+# Predictions of a trained model, made once per split when it is trained: labels or values, class
+# probabilities and residuals as compact arrays. Metrics, curves and exports are computed from them
+# without calling the model again
+
+def split_predictions(ml_mod, x, y):
+    if is_classifier(ml_mod) and hasattr(ml_mod, 'predict_proba'):
+        # Labels are the most probable classes, like predict, so the model runs only once. They are
+        # taken before the probabilities are stored in float32, where near ties could round to another class
+        proba = ml_mod.predict_proba(x)
+        pred = ml_mod.classes_[proba.argmax(axis=1)]
+        return {'pred': pred, 'proba': proba.astype('float32'), 'classes': ml_mod.classes_}
+    if is_classifier(ml_mod):
+        return {'pred': ml_mod.predict(x)}
+    pred = ml_mod.predict(x).astype('float32')
+    return {'pred': pred, 'residuals': np.asarray(y, dtype='float32') - pred}
+
+def prediction_frame(predictions):
+    # Predictions of a split as a table, with one probability column per class
+    df = pd.DataFrame({'pred': predictions['pred']})
+    if 'proba' in predictions:
+        for i, c in enumerate(predictions['classes']):
+            df[f'proba_{c}'] = predictions['proba'][:, i]
+    return df
+
+def positive_class(classes):
+    # Position of the class scored by binary metrics: 1 when it is a class (the scikit-learn default),
+    # otherwise the last one
+    matches = np.flatnonzero(classes == 1) if classes.dtype != object else np.empty(0, dtype=int)
+    return int(matches[0]) if len(matches) else len(classes) - 1
+
+def positive_scores(predictions):
+    # Probability of the positive class of a binary classifier, with that class
+    positive = positive_class(predictions['classes'])
+    return predictions['proba'][:, positive], predictions['classes'][positive]
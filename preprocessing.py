@@ -0,0 +1,282 @@
+import pandas as pd
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import OneHotEncoder
+from sklearn.ensemble import HistGradientBoostingRegressor, HistGradientBoostingClassifier
+from data_loading import text_to_numeric
+from cache_utils import make_fingerprint
+
+def sparse_frame(matrix, columns, index):
+    # One sparse column (zeros not stored) per encoded level. DataFrame.sparse.from_spmatrix isn't used
+    # because some pandas versions store the zeros as missing values
+    matrix = matrix.tocsc()
+    return pd.DataFrame(
+        {c: pd.arrays.SparseArray.from_spmatrix(matrix[:, [i]]) for i, c in enumerate(columns)},
+        index=index
+    )
+
+def sparse_columns(df):
+    return [c for c in df.columns if isinstance(df[c].dtype, pd.SparseDtype)]
+
+def keep_rows(df, mask):
+    # Row filter of a frame: its sparse columns are filtered as one matrix, much faster than column by column
+    columns = sparse_columns(df)
+    if not columns or mask.all():
+        return df[mask]
+    mask = np.asarray(mask)
+    block = sparse_frame(df[columns].sparse.to_coo().tocsr()[mask], columns, df.index[mask])
+    return pd.concat([df.drop(columns=columns)[mask], block], axis=1)[df.columns]
+
+def model_input(x, ml_mod):
+    # Data with sparse one-hot columns reaches the models that accept it as one CSR matrix (columns in
+    # the same order), histogram gradient boosting and data without sparse columns are left as they are
+    columns = sparse_columns(x)
+    if not columns or isinstance(getattr(ml_mod, 'estimator', ml_mod), (HistGradientBoostingRegressor, HistGradientBoostingClassifier)):
+        return x
+    dense_columns = [c for c in x.columns if c not in columns]
+    matrix = sp.hstack([
+        sp.csr_matrix(x[dense_columns].to_numpy(dtype='float64', na_value=np.nan)),
+        x[columns].sparse.to_coo()
+    ]).tocsr()
+    stacked = {c: i for i, c in enumerate(dense_columns + columns)}
+    return matrix[:, [stacked[c] for c in x.columns]]
+
+def encoder_input(df):
+    # Text as plain objects with NaN for missing values: the encoder refuses the pd.NA of Arrow-backed
+    # (Parquet, Feather, pyarrow CSV) and nullable string columns
+    df = df.astype(object)
+    return df.where(df.notna(), np.nan)
+
+class CategoricalStep:
+    # Removes or encodes the text/category columns found when it is fitted
+    def __init__(self, method, min_frequency=None, max_categories=None):
+        self.method = method
+        self.min_frequency = min_frequency
+        self.max_categories = max_categories
+        self.columns = []
+        self.categories = {}
+        self.encoder = None
+
+    def options(self):
+        # Rare levels are only grouped by one-hot encoding
+        if self.method not in ['One-hot encoding', 'One-hot encoding (sparse)']:
+            return (self.method,)
+        return (self.method, self.min_frequency, self.max_categories)
+
+    def fit_transform(self, df):
+        self.columns = list(df.select_dtypes(include=['object', 'string', 'category']).columns)
+        if self.method == 'Label encoding':
+            # Codes follow the sorted categories, like LabelEncoder
+            self.categories = {c: sorted(df[c].dropna().unique()) for c in self.columns}
+        elif self.method in ['One-hot encoding', 'One-hot encoding (sparse)'] and self.columns:
+            # Categories unseen in training get zeros in every column of their variable, and rare
+            # levels can share one 'infrequent' column
+            self.encoder = OneHotEncoder(
+                sparse_output=self.method == 'One-hot encoding (sparse)',
+                drop='if_binary',
+                handle_unknown='ignore',
+                min_frequency=self.min_frequency,
+                max_categories=self.max_categories
+            )
+            self.encoder.fit(encoder_input(df[self.columns]))
+        return self.transform(df)
+
+    def transform(self, df):
+        columns = [c for c in self.columns if c in df.columns]
+        if self.method == 'Remove columns':
+            return df.drop(columns=columns)
+        if self.method == 'Label encoding':
+            df = df.copy()
+            for c in columns:
+                # Missing and unseen categories are left missing
+                codes = pd.Categorical(df[c], categories=self.categories[c]).codes
+                df[c] = np.where(codes < 0, np.nan, codes) if (codes < 0).any() else codes
+            return df
+        if self.encoder is not None:
+            # Categorical columns left out of new data don't feed the model, they are encoded as unseen
+            df = df.assign(**{c: pd.Series(None, index=df.index, dtype=object) for c in self.columns if c not in df.columns})
+            encoded = self.encoder.transform(encoder_input(df[self.columns]))
+            if sp.issparse(encoded):
+                encoded_df = sparse_frame(encoded, self.encoder.get_feature_names_out(self.columns), df.index)
+            else:
+                encoded_df = pd.DataFrame(
+                    encoded,
+                    columns=self.encoder.get_feature_names_out(self.columns),
+                    index=df.index
+                )
+            return pd.concat([df.drop(columns=self.columns), encoded_df], axis=1)
+        return df
+
+class MissingStep:
+    # Drops the incomplete rows or fills them with the statistics of the training data
+    def __init__(self, method):
+        self.method = method
+        self.fill_values = pd.Series(dtype='float64')
+
+    def options(self):
+        return (self.method,)
+
+    def fit_transform(self, df):
+        # Sparse one-hot columns never miss values, they are skipped
+        dense = df.drop(columns=sparse_columns(df))
+        if self.method == 'Imputation: mean':
+            self.fill_values = dense.mean(numeric_only=True)
+        elif self.method == 'Imputation: median':
+            self.fill_values = dense.median(numeric_only=True)
+        return self.transform(df, training=True)
+
+    def transform(self, df, training=False):
+        if self.method == 'Remove observation':
+            # Rows are only removed from the training data, every row to predict gets a prediction
+            return keep_rows(df, df.drop(columns=sparse_columns(df)).notna().all(axis=1)) if training else df
+        if len(self.fill_values):
+            return df.fillna(self.fill_values[self.fill_values.index.intersection(df.columns)])
+        return df
+
+def outlier_bounds(values, detector, threshold):
+    # Lower and upper bound of every column of a 2D array, computed for all the columns at once
+    if detector == 'Z-score':
+        mean, std = np.nanmean(values, axis=0), np.nanstd(values, axis=0, ddof=1)
+        return mean - threshold * std, mean + threshold * std
+    if detector == 'MAD':
+        # Scaled so that it matches the standard deviation of normally distributed data
+        median = np.nanmedian(values, axis=0)
+        mad = 1.4826 * np.nanmedian(np.abs(values - median), axis=0)
+        return median - threshold * mad, median + threshold * mad
+    if detector == 'Percentiles':
+        return tuple(np.nanpercentile(values, [threshold, 100 - threshold], axis=0))
+    q1, q3 = np.nanpercentile(values, [25, 75], axis=0)
+    iqr = q3 - q1
+    return q1 - threshold * iqr, q3 + threshold * iqr
+
+class OutlierStep:
+    # Values of the training data outside the detector's bounds are removed, replaced or clipped.
+    # Every numeric column is handled at once, as one array
+    def __init__(self, method, detector='IQR', threshold=1.5):
+        self.method = method
+        self.detector = detector
+        self.threshold = threshold
+        self.columns = []
+        self.lower_bound = np.empty(0)
+        self.upper_bound = np.empty(0)
+        self.fill_values = np.empty(0)
+
+    def options(self):
+        if self.method == 'Keep as-is':
+            return (self.method,)
+        return (self.method, self.detector, self.threshold)
+
+    def fit_transform(self, df):
+        if self.method == 'Keep as-is':
+            return df
+        numeric = df.select_dtypes(include=['number']).drop(columns=sparse_columns(df))
+        values = numeric.to_numpy(dtype='float64', na_value=np.nan)
+
+        # Binary variables (e.g. one-hot encoded columns: only zeros and ones, both present) have no outliers
+        zeros, ones = values == 0, values == 1
+        binary = (zeros | ones).all(axis=0) & zeros.any(axis=0) & ones.any(axis=0)
+        self.columns = list(numeric.columns[~binary])
+        values = values[:, ~binary]
+
+        with np.errstate(all='ignore'):
+            self.lower_bound, self.upper_bound = outlier_bounds(values, self.detector, self.threshold)
+            if self.method == 'Imputation: mean':
+                self.fill_values = np.nanmean(values, axis=0)
+            elif self.method == 'Imputation: median':
+                self.fill_values = np.nanmedian(values, axis=0)
+        return self.transform(df, training=True, values=values)
+
+    def transform(self, df, training=False, values=None):
+        # Columns missing from new data are skipped
+        present = [i for i, c in enumerate(self.columns) if c in df.columns]
+        if not present:
+            return df
+        columns = [self.columns[i] for i in present]
+        if values is None:
+            values = df[columns].to_numpy(dtype='float64', na_value=np.nan)
+        lower, upper = self.lower_bound[present], self.upper_bound[present]
+        # Missing values are never outliers
+        outliers = (values < lower) | (values > upper)
+
+        if self.method == 'Remove observation':
+            # Rows are only removed from the training data, every row to predict gets a prediction
+            return keep_rows(df, ~outliers.any(axis=1)) if training else df
+        if self.method == 'Clip to bounds':
+            treated = np.clip(values, lower, upper)
+        else:
+            treated = np.where(outliers, self.fill_values[present], values)
+
+        # Only the columns with outliers change (and become float)
+        changed = outliers.any(axis=0)
+        if changed.any():
+            df = df.copy()
+            df[[c for c, ch in zip(columns, changed) if ch]] = treated[:, changed]
+        return df
+
+class PreparationPipeline:
+    # The data preparation fitted on the training data: it can be pickled and applied as-is to new data
+    def __init__(self, categorical_treat, missing_treat, outlier_treat, min_frequency=None, max_categories=None,
+                 outlier_detector='IQR', outlier_threshold=1.5):
+        self.categorical = CategoricalStep(categorical_treat, min_frequency, max_categories)
+        self.missing = MissingStep(missing_treat)
+        self.outliers = OutlierStep(outlier_treat, outlier_detector, outlier_threshold)
+        self.columns = []
+        self.numeric_columns = []
+        self.fingerprint = None
+        self.stage_fingerprints = []
+        self._positions = {}
+
+    def fit_transform(self, df, fingerprint=None, cache=None):
+        # Returns the data after each step, so each one can be shown. With a cache, each fitted step and
+        # its output are kept under the fingerprint of its input and its options: changing an option
+        # only recomputes that step and the following ones
+        self.numeric_columns = list(df.select_dtypes(include=['number', 'bool']).columns)
+        self.fingerprint = fingerprint
+        self.stage_fingerprints = []
+        frames = []
+        for name in ['categorical', 'missing', 'outliers']:
+            step = getattr(self, name)
+            self.fingerprint = make_fingerprint(self.fingerprint, name, step.options())
+            self.stage_fingerprints.append(self.fingerprint)
+            entry = cache.get(self.fingerprint) if cache is not None else None
+            if entry is None:
+                entry = (step, step.fit_transform(df))
+                if cache is not None:
+                    cache.put(self.fingerprint, entry)
+            step, df = entry
+            setattr(self, name, step)
+            frames.append(df)
+        self.columns = list(df.columns)
+        return tuple(frames)
+
+    def source_columns(self, columns):
+        # Columns of the original data needed to build the given treated columns
+        sources = []
+        for c in self.numeric_columns + self.categorical.columns:
+            if any(v == c or v.startswith(f'{c}_') for v in columns):
+                sources.append(c)
+        return sources
+
+    def positions(self, columns):
+        # Positions of the given columns in the treated data, computed once per set of columns
+        key = tuple(columns)
+        if key not in self._positions:
+            positions = pd.Index(self.columns).get_indexer(key)
+            # get_indexer gives -1 for an unknown column, which iloc would read as the last one
+            if (positions < 0).any():
+                raise KeyError(f'Columns not in the treated data: {[c for c, i in zip(key, positions) if i < 0]}')
+            self._positions[key] = positions
+        return self._positions[key]
+
+    def transform(self, df, columns):
+        # Encodes, fills and treats the outliers of new data like the training data, then returns the
+        # given columns (in that order). Nothing is fitted again
+        df = df.copy()
+        for c in self.numeric_columns:
+            if c in df.columns and not pd.api.types.is_numeric_dtype(df[c]):
+                df[c] = text_to_numeric(df[c])
+        df = self.categorical.transform(df)
+        df = self.missing.transform(df)
+        df = self.outliers.transform(df)
+        df = df.reindex(columns=self.columns)
+        return df.iloc[:, self.positions(columns)]
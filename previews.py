@@ -0,0 +1,108 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+from preprocessing import sparse_columns
+
+# Comparison operators accepted in front of a number in the filter of a numeric column
+filter_operators = {
+    '>=': np.greater_equal,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '<': np.less,
+    '=': np.equal
+}
+
+def displayable(df):
+    # Streamlit can't show sparse columns, so they are shown dense
+    columns = sparse_columns(df)
+    if not columns:
+        return df
+    return df.astype({c: df[c].dtype.subtype for c in columns})
+
+def session_choice(key, options):
+    # Choices are set in the session before their widget, so they are kept when changing page. A choice
+    # kept from another frame (e.g. a column that no longer exists) is reset
+    if key not in st.session_state or st.session_state[key] not in options:
+        st.session_state[key] = options[0]
+
+def column_of(parts, column):
+    # Column of the first part that has it, with positions as index
+    for part in parts:
+        if column in part.columns:
+            return part[column].reset_index(drop=True)
+
+def filter_mask(values, text):
+    # Numbers can be compared (e.g. '> 3.5'), anything else is searched as text
+    text = text.strip()
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        for operator, function in filter_operators.items():
+            if text.startswith(operator):
+                try:
+                    number = float(text[len(operator):])
+                except ValueError:
+                    break
+                return function(values.to_numpy(dtype='float64', na_value=np.nan), number)
+    return values.astype(str).str.contains(text, case=False, regex=False).to_numpy(dtype=bool, na_value=False)
+
+def row_order(parts, fingerprint, sort_column, ascending, filter_column, filter_text):
+    # Positions of the rows to show, filtered and sorted. The last order of each preview is kept in
+    # the session, so changing page doesn't filter and sort again
+    key = (fingerprint, sort_column, ascending, filter_column, filter_text)
+    if 'table_orders' not in st.session_state:
+        st.session_state.table_orders = {}
+    cached = st.session_state.table_orders.get(fingerprint)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    positions = np.arange(len(parts[0]))
+    if filter_column and filter_text.strip():
+        positions = positions[filter_mask(column_of(parts, filter_column), filter_text)]
+    if sort_column:
+        values = column_of(parts, sort_column).iloc[positions]
+        positions = values.sort_values(ascending=ascending, na_position='last', kind='stable').index.to_numpy()
+
+    st.session_state.table_orders[fingerprint] = (key, positions)
+    return positions
+
+def paginated_dataframe(parts, key, fingerprint=None, page_size=100, height=300):
+    # Shows one page of rows of a frame, or of frames placed side by side (same rows in the same order),
+    # sorted and filtered on the server. Only the rows of the page are put together and sent to the browser.
+    # The key names the widgets in the session, so it must not contain 'prev' or 'next' (see streamlit_app)
+    if isinstance(parts, pd.DataFrame):
+        parts = [parts]
+    parts = [p.to_frame() if isinstance(p, pd.Series) else p for p in parts]
+    columns = [c for part in parts for c in part.columns]
+    n_rows = len(parts[0])
+    if fingerprint is None:
+        fingerprint = (key, tuple(id(p) for p in parts), n_rows)
+    else:
+        fingerprint = (key, fingerprint)
+
+    session_choice(f'{key}_sort', [None] + columns)
+    session_choice(f'{key}_ascending', [True, False])
+    session_choice(f'{key}_filter_column', [None] + columns)
+    if f'{key}_filter_text' not in st.session_state:
+        st.session_state[f'{key}_filter_text'] = ''
+    col = st.columns(4)
+    with col[0]:
+        sort_column = st.selectbox('Sort by', [None] + columns, key=f'{key}_sort', format_func=lambda c: '(file order)' if c is None else str(c))
+    with col[1]:
+        ascending = st.selectbox('Order', [True, False], key=f'{key}_ascending', format_func=lambda a: 'Ascending' if a else 'Descending')
+    with col[2]:
+        filter_column = st.selectbox('Filter on', [None] + columns, key=f'{key}_filter_column', format_func=lambda c: '(no filter)' if c is None else str(c))
+    with col[3]:
+        filter_text = st.text_input('Filter value (text, or > < = a number)', key=f'{key}_filter_text')
+
+    positions = row_order(parts, fingerprint, sort_column, ascending, filter_column, filter_text)
+    n_pages = max(1, -(-len(positions) // page_size))
+    session_choice(f'{key}_page', range(1, n_pages + 1))
+    page = st.number_input(f'Page (of {n_pages})', min_value=1, max_value=n_pages, step=1, key=f'{key}_page')
+    rows = positions[(page - 1) * page_size:page * page_size]
+
+    page_df = pd.concat([displayable(part.iloc[rows]).reset_index(drop=True) for part in parts], axis=1)
+    page_df.index = rows
+    st.dataframe(page_df, height=height)
+    shown = f'Rows {(page - 1) * page_size + 1 if len(rows) else 0}-{(page - 1) * page_size + len(rows)} of {len(positions)}'
+    if len(positions) < n_rows:
+        shown += f' (filtered from {n_rows})'
+    st.caption(shown)
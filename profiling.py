@@ -0,0 +1,67 @@
+import pandas as pd
+import numpy as np
+from config import profile_top_values
+from cache_utils import get_cache
+from jobs import submit_job
+from charts import finite_values, bin_counts, box_statistics
+
+# Everything the single variable panels show about a column, computed in one go per column and dataset,
+# so switching variables doesn't go through the data again
+
+def is_numeric(data):
+    # Numeric whatever the backend (NumPy or Arrow) and width, booleans are treated as categories
+    return pd.api.types.is_numeric_dtype(data) and not pd.api.types.is_bool_dtype(data)
+
+def column_profile(data, nbins=20):
+    missing = int(data.isna().sum())
+    if is_numeric(data):
+        values = finite_values(data)
+        profile = {'numeric': True, 'missing': missing, 'distinct': len(np.unique(values))}
+        if not len(values):
+            profile['summary'] = pd.Series({'count': 0}, name=data.name)
+            return profile
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        # Same statistics as describe()
+        profile['summary'] = pd.Series({
+            'count': len(values),
+            'mean': values.mean(),
+            'std': values.std(ddof=1) if len(values) > 1 else np.nan,
+            'min': values.min(),
+            '25%': q1,
+            '50%': median,
+            '75%': q3,
+            'max': values.max()
+        }, name=data.name)
+        profile['histogram'] = bin_counts(values, nbins)
+        profile['box'] = box_statistics(values)
+        return profile
+
+    counts = data.value_counts()
+    top = counts.iloc[:profile_top_values]
+    return {
+        'numeric': False,
+        'missing': missing,
+        'distinct': len(counts),
+        'counts': top,
+        'other': int(counts.iloc[profile_top_values:].sum())
+    }
+
+def profile_job(job, fingerprint, df):
+    cache = get_cache('profiles')
+    for i, column in enumerate(df.columns):
+        job.report(i, len(df.columns), 'columns profiled')
+        if (fingerprint, column) not in cache:
+            cache.put((fingerprint, column), column_profile(df[column]))
+    job.report(len(df.columns), len(df.columns), 'columns profiled')
+
+def profile_dataset(df, fingerprint):
+    # Profiles every column in the background (nothing is shown while it runs)
+    submit_job('profiles', fingerprint, profile_job, fingerprint, df)
+
+def cached_profile(df, fingerprint, column):
+    # Profile of one column: taken from the index when it is already there, computed now otherwise
+    cache = get_cache('profiles')
+    profile = cache.get((fingerprint, column))
+    if profile is None:
+        profile = cache.put((fingerprint, column), column_profile(df[column]))
+    return profile
@@ -1,6 +1,8 @@
 import streamlit as st
-import pandas as pd
 import time
+from data_loading import load_file, file_columns
+from config import max_n_jobs, profile_in_background
+from profiling import profile_dataset
 
 def select_choice(var_name, options, intro_text='Select:'):
     if var_name not in st.session_state:
@@ -65,6 +67,18 @@ def slider_choice(var_name, slider_params, intro_text='Choose the value:'):
                         key = var_name
                     )
 
+def parameter_slider(var_name, slider_params, intro_text='Choose the value:'):
+    # In search mode the slider picks the range of values to try (by default from its minimum to its usual value)
+    if st.session_state.get('training_mode') == 'Hyperparameter search':
+        if var_name not in st.session_state:
+            st.session_state[var_name] = slider_params[2]
+        slider_choice(
+            var_name.replace('parameter_', 'search_'),
+            [slider_params[0], slider_params[1], (slider_params[0], slider_params[2]), slider_params[3]],
+            f'{intro_text}, range to search'
+        )
+    else:
+        slider_choice(var_name, slider_params, intro_text)
 
 def sidebar_config(i):
     with st.sidebar:
@@ -76,10 +90,31 @@ def sidebar_config(i):
             select_choice('col_sep', [',',';'] , 'What is the column separator of your file:')
             select_choice('dec_id', ['.',','] , 'What is the decimal point character:')
 
-            uploaded_file = st.file_uploader("Upload the training set", type=["csv"])
+            select_choice('csv_engine', ['pandas', 'pyarrow'] , 'Which engine should read CSV files (pyarrow is multithreaded):')
+            select_choice('memory_optimization', ['Safe', 'Aggressive (float32)', 'Off'] , 'How to reduce the memory used by the dataset:')
+
+            uploaded_file = st.file_uploader("Upload the training set", type=["csv", "parquet", "feather"])
             if uploaded_file is not None:
+                # Only the selected columns are loaded
+                all_columns = file_columns(uploaded_file, st.session_state.col_sep)
+                multiselect_choice('columns_to_load', all_columns, 'Select the columns to load:', 'All')
+                if len(st.session_state.columns_to_load) == len(all_columns):
+                    columns = None
+                else:
+                    columns = [c for c in all_columns if c in st.session_state.columns_to_load]
+
                 st.session_state.uploaded  = True
-                st.session_state.df_original = pd.read_csv(uploaded_file, sep=st.session_state.col_sep, index_col=False, decimal=st.session_state.dec_id)
+                st.session_state.df_original, st.session_state.dataset_fingerprint, st.session_state.memory_report = load_file(
+                    uploaded_file,
+                    st.session_state.col_sep,
+                    st.session_state.dec_id,
+                    st.session_state.csv_engine,
+                    columns,
+                    infer_types=True,
+                    memory_mode=st.session_state.memory_optimization
+                )
+                if profile_in_background:
+                    profile_dataset(st.session_state.df_original, st.session_state.dataset_fingerprint)
 
         elif i == 2:
 
@@ -88,20 +123,29 @@ def sidebar_config(i):
             select_choice('var_1', list(set(st.session_state.df_original.columns)) , 'Select a variable to analyze in detail:')
             select_choice('var_2', list(set(st.session_state.df_original.columns) - {st.session_state.var_1}) , 'Select a second variable to analyze in detail:')
 
+            st.header('Correlation analysis')
+            select_choice('correlation_method', ['Pearson', 'Spearman', "Cramér's V"], 'Which correlation to compute (Spearman also ranks ordered categories, Cramér\'s V is for categorical variables):')
+            select_choice('correlation_rows', ['Sample of large datasets', 'All rows'], 'Which observations to use:')
+            slider_choice('correlation_top_k', [5, 100, 10, 5], 'Number of strongest pairs to list')
+            slider_choice('correlation_max_columns', [5, 100, 30, 5], 'Maximum number of variables on the heatmap')
+
         elif i == 3:
 
             st.header('Data preparation')
             st.write('Categorical data')
             select_choice(
                 'categorical_treat', 
-                ['Remove columns', 'Label encoding', 'One-hot encoding'], 
+                ['Remove columns', 'Label encoding', 'One-hot encoding', 'One-hot encoding (sparse)'], 
                 'How to treat categorical data:'
             )
+            if st.session_state.categorical_treat in ['One-hot encoding', 'One-hot encoding (sparse)']:
+                slider_choice('onehot_min_frequency', [1, 1000, 1, 1], 'Levels seen fewer times than this are grouped as infrequent (min_frequency)')
+                slider_choice('onehot_max_categories', [0, 100, 0, 1], 'Maximum number of columns per variable, 0 for no limit (max_categories)')
 
             st.write('Missing values treatment')
             select_choice(
                 'missing_treat', 
-                ['Remove observation', 'Imputation: mean', 'Imputation: median'], 
+                ['Remove observation', 'Imputation: mean', 'Imputation: median', 'Keep as-is (histogram gradient boosting only)'], 
                 'How to treat missing values:'
             )
 
@@ -109,9 +153,19 @@ def sidebar_config(i):
             st.write('Outlier treatment')
             select_choice(
                 'outlier_treat', 
-                ['Keep as-is', 'Remove observation', 'Imputation: mean', 'Imputation: median'], 
+                ['Keep as-is', 'Remove observation', 'Imputation: mean', 'Imputation: median', 'Clip to bounds'], 
                 'How to treat outlier values:'
             )
+            if st.session_state.outlier_treat != 'Keep as-is':
+                select_choice('outlier_detector', ['IQR', 'Z-score', 'MAD', 'Percentiles'], 'How to detect outlier values:')
+                if st.session_state.outlier_detector == 'IQR':
+                    slider_choice('outlier_iqr_factor', [0.5, 5.0, 1.5, 0.1], 'Outside Q1 - k x IQR and Q3 + k x IQR (k)')
+                elif st.session_state.outlier_detector == 'Z-score':
+                    slider_choice('outlier_z_threshold', [1.0, 5.0, 3.0, 0.1], 'More than k standard deviations from the mean (k)')
+                elif st.session_state.outlier_detector == 'MAD':
+                    slider_choice('outlier_mad_threshold', [1.0, 10.0, 3.5, 0.1], 'More than k scaled median absolute deviations from the median (k)')
+                else:
+                    slider_choice('outlier_percentile', [0.5, 10.0, 1.0, 0.5], 'Below the p-th or above the (100 - p)-th percentile (p)')
 
         elif i == 4:
 
@@ -143,9 +197,9 @@ def sidebar_config(i):
             st.subheader('Machine learning model')
             if st.session_state.problem_type == 'Regression':
                 # Define the valid models for regression
-                available_models = ['Linear regression', 'Random forest', 'Gradient boosting machines']
+                available_models = ['Linear regression', 'Random forest', 'Gradient boosting machines', 'Histogram gradient boosting']
             else:
-                available_models = ['Logistic regression', 'Random forest', 'Gradient boosting machines']
+                available_models = ['Logistic regression', 'Random forest', 'Gradient boosting machines', 'Histogram gradient boosting']
 
             radio_choice(
                 'model_to_use', 
@@ -153,24 +207,35 @@ def sidebar_config(i):
                 'Choose predictive model:'
             )
 
+            if st.session_state.model_to_use != 'Linear regression':
+                st.subheader('Training mode')
+                radio_choice('training_mode', ['Single model', 'Hyperparameter search'], 'Train one model or search the best parameters:')
+                if st.session_state.training_mode == 'Hyperparameter search':
+                    radio_choice('search_strategy', ['Grid', 'Random', 'Successive halving'], 'Search strategy (successive halving drops the worst configurations early)')
+                    if st.session_state.search_strategy == 'Grid':
+                        slider_choice('search_n_values', [2, 5, 3, 1], 'Values tried per parameter')
+                    else:
+                        slider_choice('search_n_candidates', [5, 100, 20, 5], 'Configurations to try')
+                    slider_choice('search_cv_folds', [2, 10, 5, 1], 'Cross-validation folds')
+
             st.subheader('Learning Parameters')
             #if model_to_use == 'Linear regression':
                 # No additional parameters
             
             if st.session_state.model_to_use == 'Logistic regression':
                 radio_choice('parameter_penalty',['l2', 'none'],'Penalty type (penalty)')
-                slider_choice('parameter_c_value', [0.01, 10.0, 1.0, 0.01], 'Regularization strength (C)')
+                parameter_slider('parameter_c_value', [0.01, 10.0, 1.0, 0.01], 'Regularization strength (C)')
                 radio_choice('parameter_solver',['lbfgs', 'saga', 'liblinear'],'Solver')
             
             if st.session_state.model_to_use in ['Random forest', 'Gradient boosting machines']:
-                slider_choice('parameter_n_estimators', [5, 500, 100, 5], 'Number of estimators (n_estimators)')
+                parameter_slider('parameter_n_estimators', [5, 500, 100, 5], 'Number of estimators (n_estimators)')
 
                 if st.session_state.model_to_use == 'Gradient boosting machines':
-                    slider_choice('parameter_learning_rate', [0.01, 1.0, 0.1, 0.01], 'Learning rate')
+                    parameter_slider('parameter_learning_rate', [0.01, 1.0, 0.1, 0.01], 'Learning rate')
                 
-                slider_choice('parameter_max_depth', [1, 100, 10, 1], 'Maximum depth of trees (max_depth)')
-                slider_choice('parameter_min_samples_split', [2, 20, 2, 1], 'Minimum samples to split a node (min_samples_split)')
-                slider_choice('parameter_min_samples_leaf', [1, 20, 1, 1], 'Minimum samples in leaf node (min_samples_leaf)')
+                parameter_slider('parameter_max_depth', [1, 100, 10, 1], 'Maximum depth of trees (max_depth)')
+                parameter_slider('parameter_min_samples_split', [2, 20, 2, 1], 'Minimum samples to split a node (min_samples_split)')
+                parameter_slider('parameter_min_samples_leaf', [1, 20, 1, 1], 'Minimum samples in leaf node (min_samples_leaf)')
                 
                 if st.session_state.problem_type == 'Regression':
                     if st.session_state.model_to_use == 'Random forest':
@@ -190,8 +255,34 @@ def sidebar_config(i):
                 #parameter_bootstrap = st.select_slider('Bootstrap samples when building trees (bootstrap)', options=[True, False])
                 #parameter_oob_score = st.select_slider('Whether to use out-of-bag samples to estimate the R^2 on unseen data (oob_score)', options=[False, True])
 
+            if st.session_state.model_to_use == 'Histogram gradient boosting':
+                parameter_slider('parameter_n_estimators', [5, 500, 100, 5], 'Maximum number of boosting iterations (max_iter)')
+                parameter_slider('parameter_learning_rate', [0.01, 1.0, 0.1, 0.01], 'Learning rate')
+                parameter_slider('parameter_max_depth', [1, 100, 10, 1], 'Maximum depth of trees (max_depth)')
+                parameter_slider('parameter_min_samples_leaf', [1, 20, 1, 1], 'Minimum samples in leaf node (min_samples_leaf)')
+
+                if st.session_state.problem_type == 'Regression':
+                    radio_choice('parameter_criterion', ['squared_error', 'absolute_error', 'poisson'], 'Loss function (loss)')
+                else:
+                    radio_choice('parameter_criterion', ['log_loss'], 'Loss function (loss)')
+
+                radio_choice('parameter_early_stopping', ['auto', 'Yes', 'No'], 'Stop when the validation score stops improving (early_stopping)')
+                if st.session_state.categorical_treat == 'Label encoding':
+                    radio_choice('parameter_native_categorical', ['Yes', 'No'], 'Treat label-encoded columns as categories')
+
+            st.header('Evaluation')
+            if st.session_state.problem_type == 'Classification':
+                evaluation_modes = ['Train/test split', 'K-fold', 'Stratified k-fold']
+            else:
+                evaluation_modes = ['Train/test split', 'K-fold']
+            radio_choice('evaluation_mode', evaluation_modes, 'Also evaluate the model with cross-validation:')
+            if st.session_state.evaluation_mode != 'Train/test split':
+                slider_choice('cv_folds', [2, 20, 5, 1], 'Number of folds (k)')
+
             st.header('Other Parameters')
             slider_choice('parameter_random_state', [0, 1000, 42, 1], 'Seed number (random_state)')
+            if max_n_jobs > 1:
+                slider_choice('n_jobs_cap', [1, max_n_jobs, max_n_jobs, 1], 'CPU cores to use (n_jobs)')
 
         elif i == 5:
 
@@ -212,14 +303,29 @@ def sidebar_config(i):
                 radio_choice('f1_analysis', ['Yes', 'No'], 'Compare F1 Score:')
                 radio_choice('auc_analysis', ['Yes', 'No'], 'Analyze ROC AUC:', 'No')
                 radio_choice('logloss_analysis', ['Yes', 'No'], 'Compare Log Loss:', 'No')
+
+                # Binary classifiers with probabilities can move the threshold that decides the predicted class
+                if len(st.session_state.get('predictions', {}).get('test', {}).get('classes', [])) == 2:
+                    st.subheader('Decision threshold')
+                    radio_choice('threshold_analysis', ['Yes', 'No'], 'Explore the decision threshold:', 'No')
+                    if st.session_state.threshold_analysis == 'Yes':
+                        slider_choice('decision_threshold', [0.0, 1.0, 0.5, 0.01], 'Probability from which the positive class is predicted')
+                        slider_choice('cost_false_positive', [0.0, 10.0, 1.0, 0.1], 'Cost of a false positive')
+                        slider_choice('cost_false_negative', [0.0, 10.0, 1.0, 0.1], 'Cost of a false negative')
         
         elif i == 6:
             st.header('Model interpretation')
             st.subheader('Analysis parameters')
-            if st.session_state.model_to_use in ['Random forest', 'Gradient boosting machines']:
-                radio_choice('traditional_imp', ['Yes', 'No'], 'Analyze traditional feature importance:', 'Yes')
+            if st.session_state.model_to_use in ['Random forest', 'Gradient boosting machines', 'Histogram gradient boosting']:
+                if st.session_state.model_to_use != 'Histogram gradient boosting':
+                    radio_choice('traditional_imp', ['Yes', 'No'], 'Analyze traditional feature importance:', 'Yes')
                 radio_choice('permutation_imp', ['Yes', 'No'], 'Analyze permutation feature importance:', 'No')
                 radio_choice('shap_analysis', ['Yes', 'No'], 'Analyze shap values:', 'No')
+                if st.session_state.shap_analysis == 'Yes':
+                    # More rows and exact values are more precise, fewer rows and approximate values much faster
+                    slider_choice('shap_max_rows', [100, 20000, 2000, 100], 'Maximum number of test observations to explain')
+                    select_choice('shap_rows', ['Random sample', 'First rows'], 'Which test observations to explain:')
+                    select_choice('shap_algorithm', ['Exact', 'Approximate (Saabas)'], 'How to compute the SHAP values:')
                 radio_choice('partial_dep_plot', ['Yes', 'No'], 'Analyze partial dependence plot:', 'No')
                 if st.session_state.partial_dep_plot == 'Yes':
                     select_choice('var_analysis', list(set(st.session_state.x_train.columns)), 'Select a variable to analyze in detail:')
@@ -236,10 +342,18 @@ def sidebar_config(i):
                 ['.',',']
             )
 
-            uploaded_file_output = st.file_uploader("Upload the training set", type=["csv"])
+            engine_out = st.selectbox(
+                'Which engine should read CSV files (pyarrow is multithreaded):',
+                ['pandas', 'pyarrow']
+            )
+
+            uploaded_file_output = st.file_uploader("Upload the training set", type=["csv", "parquet", "feather"])
             if uploaded_file_output is not None:
                 st.session_state.predict_output  = True
-                st.session_state.df_to_predict = pd.read_csv(uploaded_file_output, sep=col_sep_out, index_col=False, decimal=dec_id_out)
+                # Only load the columns the model inputs are built from
+                needed_columns = st.session_state.preparation_pipeline.source_columns(st.session_state.input_variables)
+                columns = [c for c in file_columns(uploaded_file_output, col_sep_out) if c in needed_columns]
+                st.session_state.df_to_predict, _, _ = load_file(uploaded_file_output, col_sep_out, dec_id_out, engine_out, columns)
 
             st.session_state.download_everything = st.selectbox(
                 'Do you want to download the training and test set:',
@@ -4,6 +4,7 @@ import numpy as np
 from config import page_titles
 from login_page import login
 from sidebar import sidebar_config
+from jobs import poll_jobs
 from page_body import introduction_text, exploratory_data_analysis, data_preparation, model_training, result_analysis, model_interpretation, exercise_summary
 
 # Navigation function with forced rerun
@@ -34,7 +35,7 @@ if "run_id" not in st.session_state:
     st.session_state.run_id = 0
 
 for k, v in st.session_state.items():
-    if k != 'page' and 'next' not in k and 'prev' not in k and 'bot_restart' not in k and 'top_restart' not in k:
+    if k != 'page' and 'next' not in k and 'prev' not in k and 'bot_restart' not in k and 'top_restart' not in k and 'job_button' not in k:
         st.session_state[k] = v
 
 current_page = st.session_state.page
@@ -136,6 +137,10 @@ if current_page > 1:
         st.session_state.df_original = pd.DataFrame()
         st.session_state.df_treated = pd.DataFrame()
         st.rerun()
+
+# Keep refreshing the page while its background jobs run
+poll_jobs()
+
 # Debug
 # df = pd.read_csv('Customer_Churn.csv', sep=';', index_col=False, decimal='.')  
 # df
@@ -0,0 +1,31 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cache_utils import LRUCache, make_fingerprint
+
+def test_lru_cache_evicts_least_recently_used_values():
+    cache = LRUCache(max_bytes=3000)
+    for key in 'abc':
+        assert cache.put(key, np.zeros(100)) is not None
+    # Reading 'a' makes 'b' the least recently used entry
+    assert cache.get('a') is not None
+    cache.put('d', np.zeros(100))
+    assert 'b' not in cache and all(k in cache for k in 'acd')
+    assert cache.total_bytes == 3 * 800 and len(cache) == 3
+
+def test_lru_cache_replaces_values_and_skips_oversized_ones():
+    cache = LRUCache(max_bytes=1000)
+    cache.put('a', np.zeros(50))
+    cache.put('a', np.zeros(100))
+    assert cache.total_bytes == 800 and len(cache) == 1
+    # A value bigger than the whole cache is returned but not kept
+    big = np.zeros(1000)
+    assert cache.put('big', big) is big
+    assert 'big' not in cache and 'a' in cache
+    assert cache.pop('a').shape == (100,) and cache.total_bytes == 0
+
+def test_fingerprints_follow_their_inputs():
+    assert make_fingerprint('data', ('a', 1)) == make_fingerprint('data', ('a', 1))
+    assert make_fingerprint('data', ('a', 1)) != make_fingerprint('data', ('a', 2))
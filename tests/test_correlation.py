@@ -0,0 +1,55 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import chi2_contingency
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from correlation import cached_correlation, cached_contingency, cramers_v
+
+def dataset(missing):
+    rng = np.random.default_rng(0)
+    n = 5000
+    base = rng.normal(size=n)
+    df = pd.DataFrame({f'x{i}': base * i + rng.normal(size=n) + 1000 for i in range(5)})
+    df['constant'] = 3.0
+    df['level'] = rng.choice(['low', 'mid', 'high'], n)
+    df['group'] = np.where(base > 0, 'up', rng.choice(['down', 'flat'], n))
+    if missing:
+        for i, c in enumerate(['x1', 'x2', 'x3', 'level']):
+            df.loc[rng.random(n) < 0.1 * (i + 1), c] = np.nan
+    return df
+
+@pytest.mark.parametrize('missing', [False, True])
+@pytest.mark.parametrize('method', ['Pearson', 'Spearman'])
+def test_correlation_matches_pandas(method, missing):
+    df = dataset(missing)
+    matrix = cached_correlation(df, ('test_correlation', method, missing), method, False)
+    expected = df.select_dtypes('number').corr(method=method.lower())
+    assert list(matrix.columns) == list(expected.columns)
+    # Computed in float32, with the rows both columns have
+    np.testing.assert_allclose(matrix.to_numpy(), expected.to_numpy(), atol=1e-5)
+
+def test_contingency_matches_crosstab():
+    df = dataset(missing=True)
+    table = cached_contingency(df, 'test_contingency', 'level', 'group')
+    expected = pd.crosstab(df['level'], df['group'])
+    # Same counts, levels ordered from the most frequent
+    pd.testing.assert_frame_equal(
+        table.loc[expected.index, expected.columns], expected, check_names=False, check_dtype=False
+    )
+    assert table.index[0] == df['level'].value_counts().index[0]
+    pd.testing.assert_frame_equal(cached_contingency(df, 'test_contingency', 'group', 'level'), table.T)
+
+def test_contingency_groups_rare_levels():
+    df = pd.DataFrame({'a': list('aaaabbbccd'), 'b': list('xyxyxyxyxy')})
+    table = cached_contingency(df, 'test_contingency_rare', 'a', 'b', top_k=2)
+    assert list(table.index) == ['a', 'b', 'Other']
+    assert table.loc['Other'].tolist() == [1, 2]
+
+def test_cramers_v_matches_chi_squared():
+    df = dataset(missing=False)
+    table = pd.crosstab(df['level'], df['group']).to_numpy()
+    chi2 = chi2_contingency(table, correction=False)[0]
+    assert cramers_v(table) == pytest.approx(np.sqrt(chi2 / (table.sum() * (min(table.shape) - 1))))
@@ -0,0 +1,50 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import shap
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.inspection import partial_dependence
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jobs import Job
+from inspection import partial_dependence_job, shap_job
+
+def test_partial_dependence_of_sparse_one_hot_column():
+    # Sparse one-hot encoding gives the model input sparse columns
+    rng = np.random.default_rng(0)
+    dense = pd.DataFrame({'a': rng.normal(size=200), 'c_x': rng.integers(0, 2, 200).astype('float64')})
+    y = (dense['a'] + 2 * dense['c_x'] > 1).astype(int)
+    x = dense.astype({'c_x': pd.SparseDtype('float64', 0.0)})
+    # A classifier, whose partial dependence writes the grid values into the column (brute method)
+    ml_mod = RandomForestClassifier(n_estimators=10, n_jobs=1, random_state=0).fit(x, y)
+
+    result = partial_dependence_job(Job('test'), ml_mod, x, 'c_x', 1)
+    expected = partial_dependence(ml_mod, X=dense, features=['c_x'])
+    np.testing.assert_allclose(result['average'], expected['average'])
+    np.testing.assert_array_equal(result['grid_values'][0], [0.0, 1.0])
+
+def test_shap_job_reports_cpu_time_of_its_workers():
+    rng = np.random.default_rng(0)
+    x = pd.DataFrame(rng.normal(size=(400, 5)), columns=list('abcde'))
+    ml_mod = RandomForestClassifier(n_estimators=20, n_jobs=1, random_state=0).fit(x, x['a'] > 0)
+    job = Job('test')
+    shap_job(job, ('test_shap_cpu',), ml_mod, x, n_jobs=2)
+    # The chunks are explained by the process pool, the server only collects them
+    timings = job.timings['SHAP values']
+    assert timings['Worker CPU time (s)'] > 0
+    assert timings['CPU time (s)'] >= timings['Worker CPU time (s)']
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_chunked_shap_matches_a_single_explainer(n_jobs):
+    rng = np.random.default_rng(0)
+    x = pd.DataFrame(rng.normal(size=(300, 4)), columns=list('abcd'))
+    ml_mod = RandomForestClassifier(n_estimators=10, max_depth=5, n_jobs=1, random_state=0).fit(x, x['a'] + x['b'] > 0)
+    # Chunks come back in any order, each row must get its own values
+    explanation = shap_job(Job('test'), ('test_shap_chunks', n_jobs), ml_mod, x, n_jobs=n_jobs, chunks_per_job=5)
+    expected = shap.TreeExplainer(ml_mod)(x.to_numpy(), check_additivity=False)
+    np.testing.assert_allclose(explanation.values, expected.values, atol=1e-12)
+    np.testing.assert_allclose(explanation.base_values, expected.base_values)
+    np.testing.assert_array_equal(explanation.data, x.to_numpy())
+    assert explanation.feature_names == list('abcd')
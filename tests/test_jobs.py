@@ -0,0 +1,24 @@
+import os
+import sys
+import time
+from joblib import Parallel, delayed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jobs import Job
+
+def busy(seconds):
+    # Keeps a worker process on the CPU and returns the CPU time it used
+    start = time.process_time()
+    while time.process_time() - start < seconds:
+        pass
+    return time.process_time() - start
+
+def test_timed_counts_cpu_time_of_worker_processes():
+    job = Job('test')
+    with job.timed('Workers', 2):
+        used = sum(Parallel(n_jobs=2, backend='loky')(delayed(busy)(0.5) for _ in range(4)))
+    timings = job.timings['Workers']
+    # The server only waited: the CPU time is the workers'
+    assert timings['Worker CPU time (s)'] >= 0.9 * used
+    assert timings['CPU time (s)'] >= timings['Worker CPU time (s)']
+    assert timings['Speedup'] > 0.5
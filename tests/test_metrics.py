@@ -0,0 +1,69 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.metrics import (mean_absolute_error, mean_squared_error, r2_score, explained_variance_score, confusion_matrix,
+                             accuracy_score, precision_score, recall_score, f1_score, log_loss, roc_auc_score, average_precision_score)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import regression_metrics, classification_metrics, threshold_sweep, sweep_metrics
+from predictions import split_predictions
+
+def features(n, rng):
+    return pd.DataFrame(rng.normal(size=(n, 3)), columns=['a', 'b', 'c'])
+
+def test_regression_metrics_match_scikit_learn():
+    rng = np.random.default_rng(0)
+    x = features(500, rng)
+    y = pd.Series(x['a'] * 3 + rng.normal(size=500))
+    ml_mod = LinearRegression().fit(x[:300], y[:300])
+    metrics = regression_metrics(y[300:], split_predictions(ml_mod, x[300:], y[300:]))
+    pred = ml_mod.predict(x[300:])
+    # The predictions are stored in float32
+    assert metrics['MAE'] == pytest.approx(mean_absolute_error(y[300:], pred), rel=1e-5)
+    assert metrics['MSE'] == pytest.approx(mean_squared_error(y[300:], pred), rel=1e-5)
+    assert metrics['R²'] == pytest.approx(r2_score(y[300:], pred), rel=1e-5)
+    assert metrics['Explained variance'] == pytest.approx(explained_variance_score(y[300:], pred), rel=1e-5)
+
+@pytest.mark.parametrize('labels', [[0, 1], ['no', 'yes'], ['a', 'b', 'c']])
+def test_classification_metrics_match_scikit_learn(labels):
+    rng = np.random.default_rng(0)
+    x = features(600, rng)
+    y = pd.Series(np.asarray(labels)[np.digitize(x['a'] + rng.normal(size=600), np.linspace(-1, 1, len(labels) + 1)[1:-1])])
+    ml_mod = LogisticRegression().fit(x[:400], y[:400])
+    y_test = y[400:]
+    metrics = classification_metrics(y_test, split_predictions(ml_mod, x[400:], y_test))
+    pred, proba = ml_mod.predict(x[400:]), ml_mod.predict_proba(x[400:])
+
+    np.testing.assert_array_equal(metrics['confusion'], confusion_matrix(y_test, pred, labels=metrics['labels']))
+    assert metrics['Accuracy'] == pytest.approx(accuracy_score(y_test, pred))
+    assert metrics['F1 Score (weighted)'] == pytest.approx(f1_score(y_test, pred, average='weighted', zero_division=0))
+    assert metrics['Log Loss'] == pytest.approx(log_loss(y_test, proba, labels=ml_mod.classes_), rel=1e-6)
+    if len(labels) == 2:
+        # Binary metrics score the positive class (1, otherwise the last class)
+        positive = ml_mod.classes_[-1]
+        assert metrics['Precision'] == pytest.approx(precision_score(y_test, pred, pos_label=positive))
+        assert metrics['Recall'] == pytest.approx(recall_score(y_test, pred, pos_label=positive))
+        assert metrics['ROC AUC'] == pytest.approx(roc_auc_score(y_test == positive, proba[:, 1]), rel=1e-6)
+        assert metrics['Average precision'] == pytest.approx(average_precision_score(y_test == positive, proba[:, 1]), rel=1e-6)
+    else:
+        assert metrics['Precision'] == pytest.approx(precision_score(y_test, pred, average='weighted', zero_division=0))
+        assert metrics['ROC AUC'] == pytest.approx(roc_auc_score(y_test, proba, multi_class='ovr'), rel=1e-6)
+
+def test_threshold_sweep_matches_confusion_matrix():
+    rng = np.random.default_rng(0)
+    y = rng.choice(['no', 'yes'], 1000)
+    # Rounded scores, so that several rows share the same score
+    scores = np.round(np.clip((y == 'yes') * 0.3 + rng.random(1000) * 0.7, 0, 1), 2).astype('float32')
+    predictions = {'proba': np.column_stack([1 - scores, scores]), 'classes': np.array(['no', 'yes'])}
+    thresholds = np.array([0.0, 0.15, 0.5, 0.51, 0.9, 1.0, 1.01], dtype='float32')
+    table = sweep_metrics(threshold_sweep(y, predictions), thresholds, cost_fp=2.0, cost_fn=5.0)
+    for threshold, row in zip(thresholds, table.itertuples()):
+        pred = np.where(scores >= threshold, 'yes', 'no')
+        tn, fp, fn, tp = confusion_matrix(y, pred, labels=['no', 'yes']).ravel()
+        assert (row.TP, row.FP, row.FN, row.TN) == (tp, fp, fn, tn)
+        assert row.Precision == pytest.approx(precision_score(y, pred, pos_label='yes', zero_division=0))
+        assert row.Recall == pytest.approx(recall_score(y, pred, pos_label='yes'))
+        assert row.Cost == 2.0 * fp + 5.0 * fn
@@ -0,0 +1,106 @@
+import io
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_loading import read_file
+from preprocessing import PreparationPipeline, outlier_bounds
+
+def parquet_upload(df):
+    # Stands in for a Streamlit upload: a file-like object with a name
+    upload = io.BytesIO()
+    df.to_parquet(upload)
+    upload.name = 'data.parquet'
+    return upload
+
+@pytest.mark.parametrize('method', ['One-hot encoding', 'One-hot encoding (sparse)'])
+def test_one_hot_parquet_text_with_missing_value(method):
+    # Parquet text columns are Arrow-backed and hold pd.NA for missing values
+    df = read_file(parquet_upload(pd.DataFrame({'a': [1.0, 2.0, 3.0, 4.0], 'c': ['x', None, 'y', 'x']})), ',', '.')
+    pipeline = PreparationPipeline(method, 'Imputation: mean', 'Keep as-is')
+    _, _, treated = pipeline.fit_transform(df)
+    encoded = treated.filter(like='c_').astype('float64')
+    # The missing value has its own level, the known levels are encoded as usual
+    assert encoded.sum(axis=1).tolist() == [1.0, 1.0, 1.0, 1.0]
+    assert encoded['c_x'].tolist() == [1.0, 0.0, 0.0, 1.0]
+
+    new = pd.DataFrame({'a': [5.0], 'c': pd.Series([pd.NA], dtype='string[pyarrow]')})
+    assert np.isfinite(pipeline.transform(new, list(treated.columns)).astype('float64').to_numpy()).all()
+
+def test_transform_refuses_columns_unknown_to_the_pipeline():
+    df = pd.DataFrame({'a': [1.0, 2.0, 3.0, 4.0], 'c': ['x', 'y', 'y', 'x']})
+    pipeline = PreparationPipeline('One-hot encoding', 'Imputation: mean', 'Keep as-is')
+    _, _, treated = pipeline.fit_transform(df)
+    with pytest.raises(KeyError, match='renamed'):
+        pipeline.transform(df, ['a', 'renamed'])
+    # Known columns are returned in the given order
+    assert pipeline.transform(df, ['c_y', 'a']).columns.tolist() == ['c_y', 'a']
+
+def test_unused_one_hot_options_keep_the_stage_fingerprints():
+    df = pd.DataFrame({'a': [1.0, 2.0, 3.0, 4.0], 'c': ['x', 'y', 'y', 'x']})
+    def fingerprints(method, min_frequency):
+        pipeline = PreparationPipeline(method, 'Imputation: mean', 'Keep as-is', min_frequency=min_frequency)
+        pipeline.fit_transform(df, fingerprint='data')
+        return pipeline.stage_fingerprints
+    # Label encoding doesn't group rare levels, one-hot encoding does
+    assert fingerprints('Label encoding', 1) == fingerprints('Label encoding', 5)
+    assert fingerprints('One-hot encoding', 1) != fingerprints('One-hot encoding', 5)
+
+def baseline_outliers(df, method):
+    # The treatment the data preparation page applied before the pipeline: IQR bounds with 1.5, one
+    # column at a time, binary columns skipped
+    df = df.copy()
+    bin_vars = [c for c in df.columns if set(df[c].unique()) == {0, 1}]
+    q1 = df.select_dtypes(include=['float64', 'int64']).quantile(0.25)
+    q3 = df.select_dtypes(include=['float64', 'int64']).quantile(0.75)
+    iqr = q3 - q1
+    lower_bound, upper_bound = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+    keep_rows_mask = pd.Series(True, index=df.index)
+    for c in df.select_dtypes(include=['float64', 'int64']).columns:
+        if c not in bin_vars:
+            outliers = (df[c] < lower_bound[c]) | (df[c] > upper_bound[c])
+            if method == 'Remove observation':
+                keep_rows_mask &= ~outliers
+                df = df[keep_rows_mask]
+            elif method == 'Imputation: mean':
+                df[c] = df[c].where(~outliers, df[c].mean())
+            elif method == 'Imputation: median':
+                df[c] = df[c].where(~outliers, df[c].median())
+    return df
+
+def outlier_data():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'a': rng.normal(size=500),
+        'b': rng.standard_t(2, size=500),
+        'flag': rng.integers(0, 2, 500).astype('float64'),
+        'count': rng.poisson(3, 500).astype('int64')
+    })
+    df.loc[rng.random(500) < 0.05, 'a'] = np.nan
+    return df
+
+# (the original code filters the rows with a mask of the unfiltered frame, which pandas reindexes)
+@pytest.mark.filterwarnings('ignore:Boolean Series key')
+@pytest.mark.parametrize('method', ['Remove observation', 'Imputation: mean', 'Imputation: median'])
+def test_outlier_treatment_matches_the_column_by_column_version(method):
+    df = outlier_data()
+    pipeline = PreparationPipeline('Label encoding', 'Keep as-is', method)
+    _, _, treated = pipeline.fit_transform(df)
+    pd.testing.assert_frame_equal(treated, baseline_outliers(df, method), check_dtype=False)
+
+@pytest.mark.parametrize('detector, threshold', [('Z-score', 2.0), ('MAD', 3.0), ('Percentiles', 5.0)])
+def test_outlier_bounds_match_pandas(detector, threshold):
+    df = outlier_data()[['a', 'b']]
+    lower, upper = outlier_bounds(df.to_numpy(), detector, threshold)
+    if detector == 'Z-score':
+        expected = df.mean() - threshold * df.std(), df.mean() + threshold * df.std()
+    elif detector == 'MAD':
+        mad = 1.4826 * (df - df.median()).abs().median()
+        expected = df.median() - threshold * mad, df.median() + threshold * mad
+    else:
+        expected = df.quantile(threshold / 100), df.quantile(1 - threshold / 100)
+    np.testing.assert_allclose(lower, expected[0])
+    np.testing.assert_allclose(upper, expected[1])
@@ -0,0 +1,63 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, HistGradientBoostingClassifier
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from jobs import Job, JobCancelled
+from training import fit_and_predict, fit_with_progress, resize_ensemble
+
+def splits():
+    rng = np.random.default_rng(0)
+    x = pd.DataFrame(rng.normal(size=(300, 4)), columns=['a', 'b', 'c', 'd'])
+    y = pd.Series((x['a'] + x['b'] * x['c'] + rng.normal(size=300) > 0).astype(int))
+    return x[:200], x[200:].reset_index(drop=True), y[:200], y[200:].reset_index(drop=True)
+
+def trained(ml_mod, n_estimators, x_train, x_test, y_train, y_test):
+    ml_mod = clone(ml_mod).set_params(n_estimators=n_estimators)
+    return fit_and_predict(Job('test'), ('test_training', repr(ml_mod)), ml_mod, x_train, x_test, y_train, y_test, 1)
+
+def resized(previous, n_estimators):
+    return resize_ensemble(Job('test'), ('test_resize', id(previous), n_estimators), previous, n_estimators, 1)
+
+@pytest.mark.parametrize('ml_mod', [
+    RandomForestClassifier(max_features=2, n_jobs=1, random_state=0),
+    GradientBoostingClassifier(subsample=0.8, max_features=2, random_state=0)
+])
+def test_resized_ensemble_equals_fit_from_scratch(ml_mod):
+    data = splits()
+    base = trained(ml_mod, 20, *data)
+    def check(result, n_estimators):
+        expected = trained(ml_mod, n_estimators, *data)
+        np.testing.assert_array_equal(result['predictions']['test']['proba'], expected['predictions']['test']['proba'])
+
+    # Growing the same cached model twice, shrinking it, and growing the shrunk model
+    check(resized(base, 30), 30)
+    check(resized(base, 40), 40)
+    shrunk = resized(base, 10)
+    check(shrunk, 10)
+    check(resized(shrunk, 25), 25)
+    # The cached model itself is unchanged
+    check(base, 20)
+
+@pytest.mark.parametrize('early_stopping', [False, True])
+def test_histogram_boosting_batches_equal_single_fit(early_stopping):
+    x_train, x_test, y_train, _ = splits()
+    ml_mod = HistGradientBoostingClassifier(max_iter=50, early_stopping=early_stopping, n_iter_no_change=3, random_state=0)
+    expected = clone(ml_mod).fit(x_train, y_train)
+    fit_with_progress(Job('test'), ml_mod, x_train, y_train)
+    assert ml_mod.n_iter_ == expected.n_iter_
+    assert ml_mod.max_iter == 50 and not ml_mod.warm_start
+    np.testing.assert_array_equal(ml_mod.predict_proba(x_test), expected.predict_proba(x_test))
+
+def test_cancelled_histogram_boosting_stops_after_its_batch():
+    x_train, _, y_train, _ = splits()
+    ml_mod = HistGradientBoostingClassifier(max_iter=50, early_stopping=False, random_state=0)
+    job = Job('test')
+    job._cancel_event.set()
+    with pytest.raises(JobCancelled):
+        fit_with_progress(job, ml_mod, x_train, y_train)
+    assert ml_mod.n_iter_ == 5
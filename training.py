@@ -0,0 +1,429 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import copy
+from contextlib import contextmanager
+from scipy.stats import randint, uniform, loguniform
+from sklearn.base import clone
+from sklearn.experimental import enable_halving_search_cv
+from sklearn.model_selection import train_test_split, GridSearchCV, RandomizedSearchCV, HalvingRandomSearchCV
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier, GradientBoostingRegressor, GradientBoostingClassifier
+from sklearn.ensemble import HistGradientBoostingRegressor, HistGradientBoostingClassifier
+from threadpoolctl import threadpool_limits
+from cache_utils import get_cache, make_fingerprint
+from preprocessing import model_input
+from predictions import split_predictions
+from jobs import submit_job, job_result, session_n_jobs
+
+def model_parameters():
+    # Every parameter chosen on the sidebar of the training page
+    return {k: st.session_state[k] for k in sorted(st.session_state.keys()) if k.startswith('parameter_')}
+
+def search_mode():
+    return st.session_state.get('training_mode') == 'Hyperparameter search' and st.session_state.model_to_use != 'Linear regression'
+
+# Parameters whose range can be searched on the sidebar, for each model
+search_ranges = {
+    'Logistic regression': ['c_value'],
+    'Random forest': ['n_estimators', 'max_depth', 'min_samples_split', 'min_samples_leaf'],
+    'Gradient boosting machines': ['n_estimators', 'learning_rate', 'max_depth', 'min_samples_split', 'min_samples_leaf'],
+    'Histogram gradient boosting': ['n_estimators', 'learning_rate', 'max_depth', 'min_samples_leaf']
+}
+
+def search_settings():
+    # Ranges and options used by the hyperparameter search, empty when a single model is trained. The
+    # controls of other strategies and models stay in the session but don't change the search
+    if not search_mode():
+        return {}
+    strategy = st.session_state.search_strategy
+    keys = ['search_strategy', 'search_cv_folds', 'search_n_values' if strategy == 'Grid' else 'search_n_candidates']
+    keys += ['search_' + p for p in search_ranges.get(st.session_state.model_to_use, [])]
+    return {k: st.session_state[k] for k in keys if k in st.session_state}
+
+def training_fingerprint(exclude=()):
+    # Identifies a trained model: treated dataset, variables, model and its parameters (except the excluded ones)
+    return make_fingerprint(
+        st.session_state.treated_fingerprint,
+        st.session_state.problem_type,
+        st.session_state.model_to_use,
+        st.session_state.get('balance_strat'),
+        st.session_state.to_predict,
+        list(st.session_state.input_variables),
+        {k: v for k, v in model_parameters().items() if k not in exclude},
+        search_settings()
+    )
+
+def ensemble_fingerprint():
+    # Identifies the models that only differ by their number of trees, None for the models that can't be resized
+    if search_mode() or st.session_state.model_to_use not in ['Random forest', 'Gradient boosting machines']:
+        return None
+    return training_fingerprint(exclude=('parameter_n_estimators',))
+
+def native_categorical_features():
+    # Label-encoded inputs the histogram booster can treat as categories (codes within its 255 bins)
+    if st.session_state.get('parameter_native_categorical') != 'Yes' or st.session_state.categorical_treat != 'Label encoding':
+        return None
+    df = st.session_state.df_treated
+    columns = []
+    for c in st.session_state.label_encoded_columns:
+        if c in st.session_state.input_variables:
+            codes = df[c].dropna()
+            if codes.between(0, 254).all() and (codes % 1 == 0).all():
+                columns.append(c)
+    return columns or None
+
+def build_model():
+    if st.session_state.problem_type == 'Regression':
+        if st.session_state.model_to_use == 'Linear regression':
+            # Linear Regression does not require additional hyperparameters in most cases
+            ml_mod = LinearRegression()
+
+        elif st.session_state.model_to_use == 'Random forest':
+            ml_mod = RandomForestRegressor(
+                n_estimators=st.session_state.parameter_n_estimators,
+                random_state=st.session_state.parameter_random_state,
+                criterion=st.session_state.parameter_criterion,
+                max_depth=st.session_state.parameter_max_depth,
+                min_samples_split=st.session_state.parameter_min_samples_split,
+                min_samples_leaf=st.session_state.parameter_min_samples_leaf,
+                n_jobs=session_n_jobs()
+            )
+
+        elif st.session_state.model_to_use == 'Gradient boosting machines':
+            ml_mod = GradientBoostingRegressor(
+                loss=st.session_state.parameter_criterion,
+                n_estimators=st.session_state.parameter_n_estimators,
+                learning_rate=st.session_state.parameter_learning_rate,
+                max_depth=st.session_state.parameter_max_depth,
+                min_samples_split=st.session_state.parameter_min_samples_split,
+                min_samples_leaf=st.session_state.parameter_min_samples_leaf,
+                random_state=st.session_state.parameter_random_state
+            )
+
+        elif st.session_state.model_to_use == 'Histogram gradient boosting':
+            ml_mod = HistGradientBoostingRegressor(
+                loss=st.session_state.parameter_criterion,
+                max_iter=st.session_state.parameter_n_estimators,
+                learning_rate=st.session_state.parameter_learning_rate,
+                max_depth=st.session_state.parameter_max_depth,
+                min_samples_leaf=st.session_state.parameter_min_samples_leaf,
+                early_stopping={'auto': 'auto', 'Yes': True, 'No': False}[st.session_state.parameter_early_stopping],
+                categorical_features=native_categorical_features(),
+                random_state=st.session_state.parameter_random_state
+            )
+
+    elif st.session_state.problem_type == 'Classification':
+        if st.session_state.model_to_use == 'Logistic regression':
+            ml_mod = LogisticRegression(
+                penalty=st.session_state.parameter_penalty,
+                C=st.session_state.parameter_c_value,
+                solver=st.session_state.parameter_solver,
+                random_state=st.session_state.parameter_random_state
+            )
+
+        elif st.session_state.model_to_use == 'Random forest':
+            if st.session_state.balance_strat == 'Balanced':
+                class_weights = 'balanced'
+            else:
+                class_weights = None
+
+            ml_mod = RandomForestClassifier(
+                n_estimators=st.session_state.parameter_n_estimators,
+                random_state=st.session_state.parameter_random_state,
+                criterion=st.session_state.parameter_criterion,
+                max_depth=st.session_state.parameter_max_depth,
+                min_samples_split=st.session_state.parameter_min_samples_split,
+                min_samples_leaf=st.session_state.parameter_min_samples_leaf,
+                class_weight=class_weights,
+                n_jobs=session_n_jobs()
+            )
+
+        elif st.session_state.model_to_use == 'Gradient boosting machines':
+            #if st.session_state.balance_strat == 'Balanced':
+            #    class_weights = compute_sample_weight(
+            #        class_weight='balanced', y=y_train)
+            #else:
+            #    class_weights = None
+            class_weights = None
+
+            ml_mod = GradientBoostingClassifier(
+                loss=st.session_state.parameter_criterion,
+                n_estimators=st.session_state.parameter_n_estimators,
+                learning_rate=st.session_state.parameter_learning_rate,
+                max_depth=st.session_state.parameter_max_depth,
+                min_samples_split=st.session_state.parameter_min_samples_split,
+                min_samples_leaf=st.session_state.parameter_min_samples_leaf,
+                random_state=st.session_state.parameter_random_state
+            )
+
+        elif st.session_state.model_to_use == 'Histogram gradient boosting':
+            ml_mod = HistGradientBoostingClassifier(
+                loss=st.session_state.parameter_criterion,
+                max_iter=st.session_state.parameter_n_estimators,
+                learning_rate=st.session_state.parameter_learning_rate,
+                max_depth=st.session_state.parameter_max_depth,
+                min_samples_leaf=st.session_state.parameter_min_samples_leaf,
+                early_stopping={'auto': 'auto', 'Yes': True, 'No': False}[st.session_state.parameter_early_stopping],
+                categorical_features=native_categorical_features(),
+                random_state=st.session_state.parameter_random_state
+            )
+
+    return ml_mod
+
+def estimator_argument(ml_mod, name):
+    # Estimator argument set by a sidebar parameter, None if the model doesn't have it
+    if name == 'c_value':
+        name = 'C'
+    elif name == 'n_estimators' and isinstance(ml_mod, (HistGradientBoostingRegressor, HistGradientBoostingClassifier)):
+        name = 'max_iter'
+    return name if name in ml_mod.get_params() else None
+
+def search_space(ml_mod, strategy, n_values):
+    # Values to try for each parameter whose range is set on the sidebar: evenly spaced values for
+    # the grid, distributions for random and successive halving (log-scaled for rates and C)
+    space = {}
+    for k in sorted(st.session_state.keys()):
+        if not k.startswith('search_') or not isinstance(st.session_state[k], tuple):
+            continue
+        argument = estimator_argument(ml_mod, k[len('search_'):])
+        if argument is None:
+            continue
+        low, high = st.session_state[k]
+        is_int = isinstance(low, int)
+        if low == high:
+            space[argument] = [low]
+        elif strategy == 'Grid':
+            values = np.linspace(low, high, n_values)
+            space[argument] = sorted(set(int(round(v)) for v in values)) if is_int else [float(v) for v in values]
+        elif is_int:
+            space[argument] = randint(low, high + 1)
+        elif argument in ['learning_rate', 'C']:
+            space[argument] = loguniform(low, high)
+        else:
+            space[argument] = uniform(low, high - low)
+    return space
+
+def build_search(ml_mod, n_jobs):
+    # The configurations are cross-validated in parallel on a process pool, so the model itself uses one core
+    if 'n_jobs' in ml_mod.get_params():
+        ml_mod.set_params(n_jobs=1)
+    strategy = st.session_state.search_strategy
+    space = search_space(ml_mod, strategy, st.session_state.get('search_n_values', 3))
+    if strategy == 'Grid':
+        return GridSearchCV(ml_mod, space, cv=st.session_state.search_cv_folds, n_jobs=n_jobs)
+    if strategy == 'Random':
+        return RandomizedSearchCV(
+            ml_mod, space, n_iter=st.session_state.search_n_candidates, cv=st.session_state.search_cv_folds,
+            n_jobs=n_jobs, random_state=st.session_state.parameter_random_state
+        )
+    # Every round keeps the best third of the configurations and gives them three times more rows
+    return HalvingRandomSearchCV(
+        ml_mod, space, n_candidates=st.session_state.search_n_candidates, cv=st.session_state.search_cv_folds,
+        factor=3, n_jobs=n_jobs, random_state=st.session_state.parameter_random_state
+    )
+
+def search_leaderboard(search):
+    # One row per configuration (per round for successive halving), best first
+    results = pd.DataFrame(search.cv_results_)
+    columns = [c for c in results.columns if c.startswith('param_')]
+    columns += [c for c in ['iter', 'n_resources'] if c in results.columns]
+    columns += ['mean_test_score', 'std_test_score', 'mean_fit_time', 'rank_test_score']
+    leaderboard = results[columns].rename(columns=lambda c: c.replace('param_', ''))
+    if 'iter' in leaderboard.columns:
+        leaderboard = leaderboard.sort_values(['iter', 'rank_test_score'], ascending=[False, True])
+    else:
+        leaderboard = leaderboard.sort_values('rank_test_score')
+    return leaderboard.reset_index(drop=True)
+
+def fit_with_progress(job, ml_mod, x_train, y_train):
+    # Forests grow a few trees at a time and boosting reports each stage, so the job can show
+    # its progress and stop when cancelled
+    if isinstance(ml_mod, (RandomForestRegressor, RandomForestClassifier)):
+        n_trees = ml_mod.n_estimators
+        # At most five batches, as each fit validates the data again. A batch has at least one tree
+        # per core, the trees of a resized forest are kept
+        step = max(ml_mod.n_jobs, -(-n_trees // 5))
+        n_built = len(getattr(ml_mod, 'estimators_', []))
+        ml_mod.set_params(warm_start=True)
+        for n in range(n_built + step, n_trees + step, step):
+            ml_mod.set_params(n_estimators=min(n, n_trees))
+            ml_mod.fit(x_train, y_train)
+            job.report(min(n, n_trees), n_trees, 'trees built')
+        ml_mod.set_params(warm_start=False)
+
+    elif isinstance(ml_mod, (GradientBoostingRegressor, GradientBoostingClassifier)):
+        n_stages = ml_mod.n_estimators
+        def monitor(i, estimator, local_variables):
+            job.report(i + 1, n_stages, 'boosting stages')
+            return False
+        # A resized model only fits its new stages
+        ml_mod.set_params(warm_start=hasattr(ml_mod, 'estimators_'))
+        ml_mod.fit(x_train, y_train, monitor=monitor)
+        ml_mod.set_params(warm_start=False)
+
+    elif isinstance(ml_mod, (GridSearchCV, RandomizedSearchCV, HalvingRandomSearchCV)):
+        # The search runs as a whole on the process pool, it can only be cancelled before it starts
+        job.report(0, 1, 'hyperparameter search running')
+        ml_mod.fit(x_train, y_train)
+        job.report(1, 1, 'hyperparameter search done')
+
+    elif isinstance(ml_mod, (HistGradientBoostingRegressor, HistGradientBoostingClassifier)):
+        # Warm starts give the same model as a single fit, early stopping ends the loop. At most ten
+        # batches, as each fit bins the data again, and the job stops between them when cancelled
+        n_iter = ml_mod.max_iter
+        step = -(-n_iter // 10)
+        ml_mod.set_params(warm_start=True)
+        for n in range(step, n_iter + step, step):
+            ml_mod.set_params(max_iter=min(n, n_iter))
+            ml_mod.fit(x_train, y_train)
+            job.report(ml_mod.n_iter_, n_iter, 'boosting iterations')
+            if ml_mod.n_iter_ < ml_mod.max_iter:
+                break
+        ml_mod.set_params(warm_start=False, max_iter=n_iter)
+
+    else:
+        job.report(0, 1, 'fitting')
+        ml_mod.fit(x_train, y_train)
+        job.report(1, 1, 'fitted')
+
+def train_model(job, fingerprint, ml_mod, df, to_predict, input_variables, split_size, random_state, n_jobs):
+    y = df[to_predict]
+    x = df[input_variables]
+
+    # Observations without a target can't be used, whatever the model
+    if y.isna().any():
+        x = x[y.notna()]
+        y = y[y.notna()]
+
+    x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=(100-split_size)/100, random_state=random_state)
+    x_train, x_test = x_train.reset_index(drop=True), x_test.reset_index(drop=True)
+    y_train, y_test = y_train.reset_index(drop=True), y_test.reset_index(drop=True)
+
+    #if st.session_state.problem_type == 'Classification' and st.session_state.model_to_use == 'Gradient boosting machines':
+    #    ml_mod.fit(x_train, y_train, sample_weight=class_weights)
+    #else:
+    #    ml_mod.fit(x_train, y_train)
+
+    return fit_and_predict(job, fingerprint, ml_mod, x_train, x_test, y_train, y_test, n_jobs)
+
+@contextmanager
+def openmp_threads(ml_mod, n_jobs):
+    # Histogram boosting runs on OpenMP threads and has no n_jobs of its own. The OpenMP thread count is
+    # a setting of the calling thread, so the limit only applies to this job's thread; the other models
+    # keep their n_jobs
+    if not isinstance(getattr(ml_mod, 'estimator', ml_mod), (HistGradientBoostingRegressor, HistGradientBoostingClassifier)):
+        yield
+        return
+    with threadpool_limits(limits=n_jobs, user_api='openmp'):
+        yield
+
+def fit_and_predict(job, fingerprint, ml_mod, x_train, x_test, y_train, y_test, n_jobs, reused_trees=0):
+    with job.timed('Fitting', n_jobs), openmp_threads(ml_mod, n_jobs):
+        fit_with_progress(job, ml_mod, model_input(x_train, ml_mod), y_train)
+
+    # A search is replaced by its best model, refitted on the whole training set
+    leaderboard = None
+    if hasattr(ml_mod, 'cv_results_'):
+        leaderboard = search_leaderboard(ml_mod)
+        ml_mod = ml_mod.best_estimator_
+
+    # Labels, probabilities and residuals of both splits are kept, nothing needs the model to predict them again
+    with job.timed('Prediction', n_jobs), openmp_threads(ml_mod, n_jobs):
+        predictions = {
+            'train': split_predictions(ml_mod, model_input(x_train, ml_mod), y_train),
+            'test': split_predictions(ml_mod, model_input(x_test, ml_mod), y_test)
+        }
+
+    # The result is cached here so it is kept even if the user left the page meanwhile
+    return get_cache('training').put(fingerprint, {
+        'ml_mod': ml_mod,
+        'x_train': x_train,
+        'x_test': x_test,
+        'y_train': y_train,
+        'y_test': y_test,
+        'y_train_pred': pd.DataFrame(predictions['train']['pred'], columns=['pred']),
+        'y_test_pred': pd.DataFrame(predictions['test']['pred'], columns=['pred']),
+        'predictions': predictions,
+        'leaderboard': leaderboard,
+        'reused_trees': reused_trees,
+        'timings': job.timings
+    })
+
+def resize_ensemble(job, fingerprint, previous, n_estimators, n_jobs):
+    # The same data, split and parameters with another number of trees: the trees of the previous
+    # model are kept, and the missing ones are added or the extra ones dropped (the model is the
+    # same as one trained from scratch, since tree i always gets the same random seed)
+    ml_mod = copy.copy(previous['ml_mod'])
+    n_before = len(ml_mod.estimators_)
+    boosting = isinstance(ml_mod, (GradientBoostingRegressor, GradientBoostingClassifier))
+    if n_estimators < n_before:
+        ml_mod.estimators_ = ml_mod.estimators_[:n_estimators]
+        if boosting:
+            ml_mod.train_score_ = ml_mod.train_score_[:n_estimators]
+            ml_mod.n_estimators_ = n_estimators
+            # Boosting draws the seeds of its stages from one random state, which is now past the dropped
+            # stages: the truncated model can't be grown
+            ml_mod._rng = None
+    elif boosting and previous['ml_mod']._rng is None:
+        # A truncated boosting model is trained again from its first stage
+        ml_mod = clone(ml_mod)
+        n_before = 0
+    elif boosting:
+        # The new stages continue the random state of the previous model, which must stay as it is
+        ml_mod._rng = copy.deepcopy(ml_mod._rng)
+    else:
+        # Forests add their new trees to their list, which must not be the previous model's
+        ml_mod.estimators_ = copy.copy(ml_mod.estimators_)
+    ml_mod.set_params(n_estimators=n_estimators)
+    if 'n_jobs' in ml_mod.get_params():
+        ml_mod.set_params(n_jobs=n_jobs)
+
+    return fit_and_predict(
+        job, fingerprint, ml_mod,
+        previous['x_train'], previous['x_test'], previous['y_train'], previous['y_test'],
+        n_jobs, reused_trees=min(n_before, n_estimators)
+    )
+
+def cached_training(fingerprint):
+    # Fitted model, splits and predictions are reused while nothing that affects them changes,
+    # otherwise the model is trained in the background (None until it is ready)
+    cache = get_cache('training')
+    result = cache.get(fingerprint)
+    base_fingerprint = ensemble_fingerprint()
+    if result is None:
+        job = st.session_state.get('jobs', {}).get('training')
+        if job is None or job.key != fingerprint:
+            # A cached model that only differs by its number of trees is resized instead of trained again
+            previous = cache.get(cache.get(('ensemble', base_fingerprint))) if base_fingerprint is not None else None
+            if previous is not None:
+                submit_job(
+                    'training',
+                    fingerprint,
+                    resize_ensemble,
+                    fingerprint,
+                    previous,
+                    st.session_state.parameter_n_estimators,
+                    session_n_jobs()
+                )
+            else:
+                submit_job(
+                    'training',
+                    fingerprint,
+                    train_model,
+                    fingerprint,
+                    build_search(build_model(), session_n_jobs()) if search_mode() else build_model(),
+                    st.session_state.df_treated,
+                    st.session_state.to_predict,
+                    st.session_state.input_variables,
+                    st.session_state.parameter_split_size,
+                    st.session_state.parameter_random_state,
+                    session_n_jobs()
+                )
+        result = job_result('training', 'Training the model')
+
+    # The last model of each ensemble is remembered, so the next one can be resized from it (unless it
+    # is a truncated boosting model, which can't be grown)
+    if result is not None and base_fingerprint is not None and getattr(result['ml_mod'], '_rng', True) is not None:
+        cache.put(('ensemble', base_fingerprint), fingerprint)
+    return result